@@ -1,48 +1,259 @@
-import sys
-from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QCheckBox, QProgressBar, QTextEdit, QFileDialog
-from PySide6.QtCore import QThread, Signal
+import sys, time, heapq, itertools, threading
+from collections import deque
+from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QCheckBox, QProgressBar, QTextEdit, QFileDialog, QTableView, QHeaderView, QAbstractItemView
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
 from PySide6.QtGui import QFont
 
 # Import your existing code
-from YTDownload import load_config, download_single_video, download_playlist, DownloadError
+from YTDownload import get_config, download_with_retry, expand_playlist, format_bytes, DownloadError
 
-class DownloadWorker(QThread):
-    progress = Signal(str)
-    finished = Signal()
-    error = Signal(str)
+# progress from the download threads is collected continuously but only shown at this rate
+REFRESH_INTERVAL_MS = 100
 
-    def __init__(self, url, is_playlist, audio_only, download_path):
-        super().__init__()
+QUEUED, ACTIVE, DONE, FAILED, CANCELLED = "Queued", "Active", "Done", "Failed", "Cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class Job:
+    def __init__(self, url, kind, audio_only, download_path, priority):
         self.url = url
-        self.is_playlist = is_playlist
+        self.kind = kind
         self.audio_only = audio_only
         self.download_path = download_path
+        self.priority = priority
+        self.queue_entry = None
+        self.title = ""
+        self.status = QUEUED
+        self.message = ""
+        self.bytes_done = 0
+        self.total = None
+        self.started_at = None
+        self.speed = 0.0
+        self.cancel_requested = False
+        # set on cancel, so a download waiting out a retry backoff wakes up
+        self.cancel_event = threading.Event()
+        self.row = None
+
+# lower priority values run first; reprioritising pushes a new entry and get() skips the stale one
+class JobQueue:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.closed = False
+
+    def put(self, job):
+        with self.condition:
+            job.queue_entry = next(self.counter)
+            heapq.heappush(self.heap, (job.priority, job.queue_entry, job))
+            self.condition.notify()
+
+    def get(self):
+        with self.condition:
+            while True:
+                while self.heap:
+                    _, entry, job = heapq.heappop(self.heap)
+                    if entry == job.queue_entry and job.status == QUEUED:
+                        return job
+                if self.closed:
+                    return None
+                self.condition.wait()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+# workers only update job fields and mark jobs dirty; the UI picks the changes up on its refresh
+# timer, so chunk-level progress never turns into one Qt signal per chunk
+class DownloadManager:
+    def __init__(self, workers):
+        self.lock = threading.Lock()
+        self.queue = JobQueue()
+        self.jobs = []
+        self.new_jobs = deque()
+        self.dirty = set()
+        self.messages = deque()
+        self.total_bytes = 0
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, jobs):
+        for job in jobs:
+            self.new_jobs.append(job)
+            self.queue.put(job)
+
+    def take_new_jobs(self):
+        jobs = []
+        while self.new_jobs:
+            jobs.append(self.new_jobs.popleft())
+        return jobs
+
+    def take_dirty(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def take_messages(self):
+        messages = []
+        while self.messages:
+            messages.append(self.messages.popleft())
+        return messages
+
+    def _update(self, job, status=None, message=None):
+        with self.lock:
+            if status is not None:
+                job.status = status
+            if message is not None:
+                job.message = message
+            self.dirty.add(job)
+
+    def cancel(self, job):
+        job.cancel_requested = True
+        job.cancel_event.set()
+        if job.status == QUEUED:
+            self._update(job, CANCELLED)
+
+    def reprioritise(self, job, priority):
+        if job.status == QUEUED:
+            job.priority = priority
+            self.queue.put(job)
+            self._update(job)
+
+    def _progress(self, job, download_job, bytes_done, total):
+        now = time.monotonic()
+        with self.lock:
+            # a re-resolved stream starts again from zero, which is not counted as negative throughput
+            self.total_bytes += max(0, bytes_done - job.bytes_done)
+            job.title = download_job["title"]
+            job.bytes_done = bytes_done
+            job.total = total
+            job.speed = bytes_done / (now - job.started_at) if now > job.started_at else 0.0
+            self.dirty.add(job)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.started_at = time.monotonic()
+            self._update(job, ACTIVE)
+            try:
+                if job.kind == "playlist":
+                    playlist_name, playlist_folder, video_urls = expand_playlist(job.url, job.audio_only, job.download_path)
+                    job.title = playlist_name
+                    if not job.cancel_requested:
+                        self.add([Job(url, "video", job.audio_only, playlist_folder, job.priority) for url in video_urls])
+                    self._update(job, CANCELLED if job.cancel_requested else DONE, f"{len(video_urls)} videos queued")
+                else:
+                    self._download(job)
+                    self._update(job, DONE)
+                    self.messages.append(f"Downloaded: {job.title or job.url}")
+            except Exception as e:
+                if job.cancel_requested:
+                    self._update(job, CANCELLED)
+                else:
+                    self._update(job, FAILED, str(e))
+                    self.messages.append(f"Error for {job.url}: {e if isinstance(e, DownloadError) else f'Unexpected error: {e}'}")
+
+    def _download(self, job):
+        def on_retry(url, attempt, max_attempts, error, kind, delay):
+            self.messages.append(f"Retrying {url} ({attempt}/{max_attempts}) in {delay:.1f}s after {kind} error: {error}")
+        download_with_retry(job.url, job.audio_only, job.download_path, cancel_event=job.cancel_event,
+                            progress=lambda download_job, bytes_done, total: self._progress(job, download_job, bytes_done, total),
+                            on_retry=on_retry)
 
-    def run(self):
-        try:
-            if self.is_playlist:
-                errors = download_playlist(self.url, self.audio_only, self.download_path)
-                if errors:
-                    for url, error in errors.items():
-                        self.progress.emit(f"Error for {url}: {error}")
-            else:
-                download_single_video(self.url, self.audio_only, self.download_path)
-            self.finished.emit()
-        except DownloadError as e:
-            self.error.emit(str(e))
-        except Exception as e:
-            self.error.emit(f"Unexpected error: {str(e)}")
+    def shutdown(self):
+        for job in self.jobs:
+            if job.status not in FINISHED:
+                self.cancel(job)
+        # workers may still be appending expanded playlists, so the deque is drained rather than iterated
+        for job in self.take_new_jobs():
+            self.cancel(job)
+        self.queue.close()
+
+class JobTableModel(QAbstractTableModel):
+    COLUMNS = ("Title / URL", "Status", "Progress", "Speed", "Priority")
+
+    def __init__(self, manager):
+        super().__init__()
+        self.manager = manager
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.manager.jobs)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        job = self.manager.jobs[index.row()]
+        column = index.column()
+        if role == Qt.ToolTipRole:
+            return job.message or job.url
+        if role != Qt.DisplayRole:
+            return None
+        if column == 0:
+            return job.title or job.url
+        if column == 1:
+            return f"{job.status}: {job.message}" if job.message and job.status == FAILED else job.status
+        if column == 2:
+            if job.total:
+                return f"{job.bytes_done * 100 // job.total}% of {format_bytes(job.total)}"
+            return "100%" if job.status == DONE else ""
+        if column == 3:
+            return f"{format_bytes(job.speed)}/s" if job.status == ACTIVE and job.speed else ""
+        return str(job.priority)
+
+    def append_jobs(self, jobs):
+        first = len(self.manager.jobs)
+        self.beginInsertRows(QModelIndex(), first, first + len(jobs) - 1)
+        for row, job in enumerate(jobs, first):
+            job.row = row
+        self.manager.jobs.extend(jobs)
+        self.endInsertRows()
+
+    def refresh_rows(self, jobs):
+        rows = [job.row for job in jobs if job.row is not None]
+        if rows:
+            # one signal for the span of changed rows instead of one per job
+            self.dataChanged.emit(self.index(min(rows), 0), self.index(max(rows), len(self.COLUMNS) - 1))
+
+    def remove_finished(self):
+        self.beginResetModel()
+        for job in self.manager.jobs:
+            if job.status in FINISHED:
+                # a late progress update must not point refresh_rows at a row that no longer exists
+                job.row = None
+        self.manager.jobs = [job for job in self.manager.jobs if job.status not in FINISHED]
+        for row, job in enumerate(self.manager.jobs):
+            job.row = row
+        self.endResetModel()
 
 class YouTubeDownloaderUI(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.config = load_config()
+        self.config = get_config()
         self.download_path = self.config["app_data"]["download_path"]
+        self.manager = DownloadManager(self.config["settings"].get("parallel_threads", 5))
+        self.model = JobTableModel(self.manager)
+        self.last_refresh = time.monotonic()
+        self.last_total_bytes = 0
+        self.throughput = 0.0
         self.initUI()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(REFRESH_INTERVAL_MS)
 
     def initUI(self):
         self.setWindowTitle('YouTube Downloader')
-        self.setGeometry(100, 100, 800, 600)
+        self.setGeometry(100, 100, 900, 700)
 
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
@@ -87,21 +298,39 @@ class YouTubeDownloaderUI(QMainWindow):
         button_layout.addWidget(download_button)
         button_layout.addWidget(clear_button)
 
+        # Job queue
+        self.job_table = QTableView()
+        self.job_table.setModel(self.model)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.job_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        # fixed row heights keep the view fast with thousands of rows
+        self.job_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.job_table.verticalHeader().setDefaultSectionSize(22)
+        queue_layout = QHBoxLayout()
+        for label, handler in (('Cancel', self.cancel_selected), ('Move to Top', self.prioritise_selected),
+                               ('Move to Bottom', self.deprioritise_selected), ('Clear Finished', self.clear_finished)):
+            button = QPushButton(label)
+            button.clicked.connect(handler)
+            queue_layout.addWidget(button)
+
         # Progress and Log
         self.progress_bar = QProgressBar()
+        self.status_label = QLabel('Idle')
         self.log_output = QTextEdit()
         self.log_output.setReadOnly(True)
+        self.log_output.document().setMaximumBlockCount(5000)
 
         # Add to main layout
         layout.addLayout(url_layout)
         layout.addLayout(options_layout)
         layout.addLayout(path_layout)
         layout.addLayout(button_layout)
+        layout.addWidget(self.job_table, stretch=3)
+        layout.addLayout(queue_layout)
         layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_label)
         layout.addWidget(QLabel('Download Log:'))
-        layout.addWidget(self.log_output)
-
-        self.setLayout(layout)
+        layout.addWidget(self.log_output, stretch=1)
 
     def browse_path(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Download Directory")
@@ -118,28 +347,68 @@ class YouTubeDownloaderUI(QMainWindow):
         is_playlist = self.playlist_check.isChecked()
         audio_only = self.audio_only_check.isChecked()
         download_path = self.path_input.text() or self.download_path
+        priority = max((job.priority for job in self.manager.jobs), default=0)
+        self.manager.add([Job(url, "playlist" if is_playlist else "video", audio_only, download_path, priority)])
+        self.url_input.clear()
+
+    def selected_jobs(self):
+        return [self.manager.jobs[index.row()] for index in self.job_table.selectionModel().selectedRows()]
 
-        self.worker = DownloadWorker(url, is_playlist, audio_only, download_path)
-        self.worker.progress.connect(self.update_progress)
-        self.worker.finished.connect(self.download_finished)
-        self.worker.error.connect(self.show_error)
-        self.worker.start()
+    def cancel_selected(self):
+        for job in self.selected_jobs():
+            self.manager.cancel(job)
 
-    def update_progress(self, message):
-        self.log_output.append(message)
+    def prioritise_selected(self):
+        top = min((job.priority for job in self.manager.jobs if job.status == QUEUED), default=0)
+        for job in self.selected_jobs():
+            self.manager.reprioritise(job, top - 1)
 
-    def download_finished(self):
-        self.log_output.append("Download completed!")
+    def deprioritise_selected(self):
+        bottom = max((job.priority for job in self.manager.jobs if job.status == QUEUED), default=0)
+        for job in self.selected_jobs():
+            self.manager.reprioritise(job, bottom + 1)
 
-    def show_error(self, error):
-        self.log_output.append(f"Error: {error}")
+    def clear_finished(self):
+        self.model.remove_finished()
+
+    def refresh(self):
+        new_jobs = self.manager.take_new_jobs()
+        if new_jobs:
+            self.model.append_jobs(new_jobs)
+        self.model.refresh_rows(self.manager.take_dirty())
+        messages = self.manager.take_messages()
+        if messages:
+            self.log_output.append("\n".join(messages))
+
+        now = time.monotonic()
+        total_bytes = self.manager.total_bytes
+        if now > self.last_refresh:
+            # smoothed over roughly a second of refreshes
+            rate = (total_bytes - self.last_total_bytes) / (now - self.last_refresh)
+            self.throughput += (rate - self.throughput) * min(1.0, (now - self.last_refresh) / 1.0)
+        self.last_refresh, self.last_total_bytes = now, total_bytes
+
+        counts = {}
+        for job in self.manager.jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        finished = sum(counts.get(status, 0) for status in FINISHED)
+        self.progress_bar.setMaximum(max(1, len(self.manager.jobs)))
+        self.progress_bar.setValue(finished)
+        self.status_label.setText(f"Active: {counts.get(ACTIVE, 0)}  Queued: {counts.get(QUEUED, 0)}  "
+                                  f"Done: {counts.get(DONE, 0)}  Failed: {counts.get(FAILED, 0)}  "
+                                  f"Cancelled: {counts.get(CANCELLED, 0)}  {format_bytes(self.throughput)}/s")
 
     def clear_input(self):
         self.url_input.clear()
         self.log_output.clear()
 
+    def closeEvent(self, event):
+        self.refresh_timer.stop()
+        self.manager.shutdown()
+        super().closeEvent(event)
+
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     ex = YouTubeDownloaderUI()
     ex.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    sys.exit(app.exec())
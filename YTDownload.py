@@ -1,8 +1,15 @@
-import os,time,re,json,unicodedata
-from tqdm import tqdm
-from pytubefix import YouTube, Playlist
-from pytubefix.cli import on_progress
-from moviepy.audio.io.AudioFileClip import AudioFileClip
+import os,time,re,json,threading
+from pipeline import DownloadPipeline
+from retry_policy import RetryPolicy
+from download_archive import DownloadArchive
+from playlist_sync import sync_playlist, watch_url
+from metadata_cache import MetadataCache, manifest_from_youtube, manifest_expired
+from stream_selection import AUDIO_CODECS, VIDEO_CODECS, codec_name, bitrate_kbps, select_audio_stream, select_video_streams, select_progressive_stream
+from transcode import FFmpegNotFound, plan_audio_output, plan_video_output, transcode_file, stream_to_file
+from rate_limit import RateLimiter, parse_rate
+from instrumentation import RunRecorder, Profiler
+from filename_index import FilenameIndex, publish_file
+from sanitize import sanitize_filename
 
 
 def load_config(path='./config.json'):
@@ -18,140 +25,761 @@ def load_config(path='./config.json'):
                 "audio_only": True,
                 "user_login": False,
                 "parallel_threads": 5,
+                "metadata_threads": 2,
+                "transcode_processes": 0,
+                "queue_depth": 4,
+                "playlist_sync": True,
+                "playlist_order": "oldest_first",
+                "streaming_transcode": True,
+                "range_connections": 4,
+                "max_download_rate": None,
+                "max_request_rate": None,
+                "metadata_cache_ttl": 21600,
+                "metadata_cache_size": 4096,
+                "metadata_concurrency": 32,
+                "shared_content": "hardlink",
+                "playlist_cache_ttl": 900,
+                "audio_policy": "auto",
+                "audio_format": "mp3",
+                "audio_bitrate": None,
+                "audio_codecs": ["mp4a", "opus"],
+                "target_audio_bitrate": None,
+                "video_streams": "adaptive",
+                "max_resolution": 1080,
+                "video_codecs": ["avc1", "vp9", "av01"],
+                "max_file_size": None,
                 "max_name_length": 85,
                 "max_retry_attempt": 10,
+                "retry_base_delay": 1,
+                "retry_max_delay": 60,
+                "retry_throttle_delay": 30,
                 "truncate_suffix": "...",
+                "profile": None,
+                "profile_interval": 0.005,
+                "daemon_host": "127.0.0.1",
+                "daemon_port": 8765,
+                "cluster_lease_seconds": 60,
             },
             "app_data": {
                 "download_path": "C:/Temp/music",
+                "archive_path": "./download_archive.db",
+                "metadata_cache_path": "./metadata_cache.db",
+                "report_path": "./run_report.jsonl",
+                "profile_path": "./run_profile",
+                "daemon_queue_path": "./daemon_queue.db",
+                "cluster_ledger_path": "./cluster_ledger.db",
                 "single_url": [],
                 "playlist_url": []
             }
         }
-config = load_config()
+config = {}
+config_path = './config.json'
+config_lock = threading.Lock()
+def get_config():
+    with config_lock:
+        if not config:
+            config.update(load_config(config_path))
+    return config
+def reload_config(path=None):
+    global config_path
+    new_config = load_config(path or config_path)
+    with config_lock:
+        config_path = path or config_path
+        config.update(new_config)
+    if rate_limiter is not None:
+        rate_limiter.configure(config["settings"].get("max_download_rate"), config["settings"].get("max_request_rate"))
+    return config
+YouTube = None
+Playlist = None
+AsyncYouTube = None
+def get_youtube_class():
+    global YouTube
+    if YouTube is None:
+        from pytubefix import YouTube
+    return YouTube
+def get_playlist_class():
+    global Playlist
+    if Playlist is None:
+        from pytubefix import Playlist
+    return Playlist
+def get_async_youtube_class():
+    # needs aiohttp, which pytubefix does not require; raises ImportError without it
+    global AsyncYouTube
+    if AsyncYouTube is None:
+        from pytubefix.async_youtube import AsyncYouTube
+    return AsyncYouTube
 class DownloadError(Exception):
     pass
-def clean_filename(name, max_length=config["settings"]["max_name_length"]):
-    name = unicodedata.normalize('NFKC', name)
-    name_parts = os.path.splitext(name)
-    base_name = name_parts[0]
-    extension = name_parts[1] if len(name_parts) > 1 else '.mp3'
-    cleaned_base = re.sub(r'[\\/:*?"\'<>|]', '', base_name)
-    cleaned_base = ''.join(char for char in cleaned_base if char.isprintable())
-    available_length = max_length - len(extension)
-    if len(cleaned_base) > available_length:
-        while len(cleaned_base.encode('utf-8')) > available_length:
-            cleaned_base = cleaned_base[:-1]
-        final_name = f"{cleaned_base}{extension}"
-    else:
-        final_name = f"{cleaned_base}{extension}"
+class DownloadCancelled(Exception):
+    pass
+filename_index = FilenameIndex()
+archive = None
+archive_lock = threading.Lock()
+def get_archive():
+    global archive
+    path = get_config()["app_data"].get("archive_path", "./download_archive.db")
+    if not path:
+        return None
+    with archive_lock:
+        if archive is None:
+            archive = DownloadArchive(path)
+    return archive
+rate_limiter = None
+rate_limiter_lock = threading.Lock()
+def get_rate_limiter():
+    global rate_limiter
+    with rate_limiter_lock:
+        if rate_limiter is None:
+            settings = get_config()["settings"]
+            rate_limiter = RateLimiter(settings.get("max_download_rate"), settings.get("max_request_rate"))
+    return rate_limiter
+downloader = None
+downloader_lock = threading.Lock()
+def get_downloader():
+    global downloader
+    from ranged_download import RangedDownloader
+    with downloader_lock:
+        if downloader is None:
+            downloader = RangedDownloader(connections=get_config()["settings"].get("range_connections", 4), limiter=get_rate_limiter())
+    return downloader
+encode_slots = None
+encode_slots_lock = threading.Lock()
+def get_encode_slots():
+    # streaming encodes run ffmpeg on download threads, so they are capped like the transcode process pool
+    global encode_slots
+    with encode_slots_lock:
+        if encode_slots is None:
+            encode_slots = threading.BoundedSemaphore(get_config()["settings"].get("transcode_processes", 0) or os.cpu_count() or 1)
+    return encode_slots
+metadata_cache = None
+metadata_cache_lock = threading.Lock()
+def get_metadata_cache():
+    global metadata_cache
+    with metadata_cache_lock:
+        if metadata_cache is None:
+            settings = get_config()["settings"]
+            metadata_cache = MetadataCache(ttl=settings.get("metadata_cache_ttl", 21600),
+                                           max_entries=settings.get("metadata_cache_size", 4096),
+                                           path=get_config()["app_data"].get("metadata_cache_path", "./metadata_cache.db") or None)
+    return metadata_cache
+run_recorder = None
+run_recorder_lock = threading.Lock()
+def get_run_recorder():
+    global run_recorder
+    with run_recorder_lock:
+        if run_recorder is None:
+            run_recorder = RunRecorder(get_config()["app_data"].get("report_path", "./run_report.jsonl") or None)
+    return run_recorder
+profiler = None
+def get_profiler():
+    global profiler
+    mode = get_config()["settings"].get("profile")
+    if not mode:
+        return None
+    with run_recorder_lock:
+        if profiler is None:
+            profiler = Profiler(mode, get_config()["settings"].get("profile_interval", 0.005))
+    return profiler
+def profiled(func):
+    active_profiler = get_profiler()
+    return active_profiler.wrap(func) if active_profiler is not None else func
+def resolve_metadata(link, video_id, refresh=False):
+    cache = get_metadata_cache()
+    key = f"video:{video_id or link}"
+    if refresh:
+        cache.invalidate(key)
+    def load():
+        get_rate_limiter().acquire_request()
+        youtubeObject = get_youtube_class()(url=link, client='WEB', use_oauth=get_config()["settings"]["user_login"])
+        return manifest_from_youtube(youtubeObject, video_id)
+    return cache.get_or_load(key, load, manifest_expired)
+# same pattern as pytubefix.extract.video_id, without importing pytubefix for archive lookups
+video_id_pattern = re.compile(r"(?:v=|\/)([0-9A-Za-z_-]{11}).*")
+def get_video_id(link):
+    match = video_id_pattern.search(link)
+    return match.group(1) if match else None
+def archive_job(job):
+    download_archive = get_archive()
+    if download_archive is not None and job["video_id"]:
+        download_archive.record(job["video_id"], job["kind"], job["final_path"], job["extension"], job["title"])
+def clean_filename(name, max_length=None):
+    settings = get_config()["settings"]
+    if max_length is None:
+        max_length = settings["max_name_length"]
+    final_name = sanitize_filename(name, max_length, settings.get("truncate_suffix") or "")
     print(f"Original name: {name}")
     print(f"Cleaned name: {final_name}")
     return final_name
 def get_unique_filename(base_path, filename):
-    name_parts = os.path.splitext(filename)
-    base_name = name_parts[0]
-    extension = name_parts[1] if len(name_parts) > 1 else '.mp3'
-    counter = 1
-    new_filename = filename
-    while os.path.exists(os.path.join(base_path, new_filename)):
-        new_name = f"{base_name} ({counter})"
-        new_filename = f"{new_name}{extension}"
-        counter += 1
-    return new_filename
-def convert_to_mp3(input_path, output_path):
+    return filename_index.unique_name(base_path, filename)
+def convert_audio(input_path, output_path, codec_args):
     try:
-        audio = AudioFileClip(input_path)
-        audio.write_audiofile(output_path, logger=None)
-        audio.close()
-        os.remove(input_path)
+        transcode_file(input_path, output_path, codec_args)
+        for path in [input_path] if isinstance(input_path, str) else input_path:
+            os.remove(path)
+    except FFmpegNotFound:
+        # raised as-is: this runs in the process pool, and a wrapping error would lose its cause on the way back
+        raise
     except Exception as e:
-        raise DownloadError(f"Error converting to MP3: {str(e)}")
-def download_single_video(link, as_audio=True, download_path=None):
-    try:
-        youtubeObject = YouTube(url=link, client='WEB', on_progress_callback=on_progress, use_oauth=config["settings"]["user_login"])
-        original_title = youtubeObject.title
-        video_title = clean_filename(original_title)
-        download_dir = download_path or os.getcwd()
+        raise DownloadError(f"Error converting audio: {str(e)}")
+def resolve_video(link, as_audio=True, download_path=None):
+    settings = get_config()["settings"]
+    download_dir = download_path or os.getcwd()
+    kind = "audio" if as_audio else "video"
+    video_id = get_video_id(link)
+    download_archive = get_archive()
+    entry = download_archive.lookup(video_id, kind, download_dir) if download_archive is not None and video_id else None
+    if entry:
+        print(f"\nSkipping: {link}")
+        print(f"Already in download archive: {entry['path']}")
+        print("-" * 30)
+        return None
+    started = time.perf_counter()
+    manifest = resolve_metadata(link, video_id)
+    timings = {"metadata": time.perf_counter() - started}
+    original_title = manifest["title"]
+    audio_stream = None
+    audio_codecs = settings.get("audio_codecs", AUDIO_CODECS)
+    target_bitrate = bitrate_kbps(settings.get("target_audio_bitrate"))
+    max_size = parse_rate(settings.get("max_file_size"))
+    if as_audio:
+        if target_bitrate is None and settings.get("audio_policy", "auto") == "transcode":
+            # a source above the encoder's bitrate only adds bytes to download
+            target_bitrate = bitrate_kbps(settings.get("audio_bitrate"))
+        stream = select_audio_stream(manifest["streams"], audio_codecs, target_bitrate, max_size)
+        if stream is None:
+            raise DownloadError(f"No audio stream available for {link}")
+        source_extension = "m4a" if stream["subtype"] == "mp4" else stream["subtype"]
+        extension, codec_args = plan_audio_output(stream["audio_codec"], source_extension, settings.get("audio_policy", "auto"),
+                                                  settings.get("audio_format", "mp3"), settings.get("audio_bitrate"))
+    else:
+        if settings.get("video_streams", "adaptive") == "adaptive":
+            stream, audio_stream = select_video_streams(manifest["streams"], settings.get("max_resolution"),
+                                                        settings.get("video_codecs", VIDEO_CODECS), audio_codecs, target_bitrate, max_size)
+        if audio_stream is not None:
+            extension, codec_args = plan_video_output(stream["video_codec"], audio_stream["audio_codec"])
+        else:
+            # progressive streams carry audio and video in one file, but only up to 360p on most videos
+            stream = select_progressive_stream(manifest["streams"])
+            if stream is None:
+                raise DownloadError(f"No progressive stream available for {link}")
+            extension, codec_args = stream["subtype"], None
+    started = time.perf_counter()
+    video_title = clean_filename(original_title)
+    with filename_index.lock:
         video_title = get_unique_filename(download_dir, video_title)
-        final_filename = os.path.splitext(video_title)[0] + '.mp3'
+        full_path = os.path.join(download_dir, video_title)
+        if len(full_path.encode('utf-8')) >= 255:
+            video_title = clean_filename(original_title, max_length=100)
+            video_title = get_unique_filename(download_dir, video_title)
+        final_filename = f"{os.path.splitext(video_title)[0]}.{extension}"
         final_path = os.path.join(download_dir, final_filename)
-        if os.path.exists(final_path):
+        if filename_index.taken(final_path):
             print(f"\nSkipping: {original_title}")
             print(f"File already exists: {final_filename}")
             print("-" * 30)
+            # a file with the same title may belong to another video, so it is not archived under this ID
+            return None
+        # files are written under names that carry the video ID and only linked to the title once finished,
+        # so a node sharing the folder that picks the same title never writes to the same files
+        stem = f"{os.path.splitext(video_title)[0]}_{video_id or 'video'}"
+        output_path = os.path.join(download_dir, f"{stem}_temp.{extension}")
+        filename = stem + '_temp' if codec_args else os.path.basename(output_path)
+        reserved = [final_path, output_path]
+        if codec_args:
+            reserved.append(os.path.join(download_dir, filename))
+        audio_filename = None
+        if audio_stream is not None:
+            audio_filename = stem + '_temp_audio'
+            reserved.append(os.path.join(download_dir, audio_filename))
+        filename_index.reserve(*reserved)
+    timings["naming"] = time.perf_counter() - started
+    return {
+        "link": link,
+        "video_id": video_id,
+        "kind": kind,
+        "title": original_title,
+        "as_audio": as_audio,
+        "stream": stream,
+        "audio_stream": audio_stream,
+        "extension": extension,
+        "codec_args": codec_args,
+        "download_dir": download_dir,
+        "filename": filename,
+        "audio_filename": audio_filename,
+        "final_filename": final_filename,
+        "final_path": final_path,
+        "output_path": output_path,
+        "reserved": reserved,
+        "timings": timings,
+    }
+def with_fresh_stream(job, download, key="stream"):
+    from ranged_download import RangedDownloadError
+    try:
+        return download(job[key])
+    except RangedDownloadError as e:
+        if e.status not in (403, 410):
+            raise
+    # the cached stream URL was rejected, most likely expired: resolve it again and retry once
+    manifest = resolve_metadata(job["link"], job["video_id"], refresh=True)
+    job[key] = next((stream for stream in manifest["streams"] if stream["itag"] == job[key]["itag"]), job[key])
+    return download(job[key])
+progress_listener = threading.local()
+def set_progress_callback(callback):
+    # callback(job, bytes_done, total) receives byte progress for downloads started on the calling thread
+    progress_listener.callback = callback
+def progress_reporter(job):
+    callback = getattr(progress_listener, "callback", None)
+    if callback is None:
+        return None
+    return lambda bytes_done, total: callback(job, bytes_done, total)
+def count_bytes(job, chunks, progress=None):
+    job["bytes"] = 0
+    for chunk in chunks:
+        job["bytes"] += len(chunk)
+        if progress:
+            progress(job["bytes"], job["stream"]["filesize"])
+        yield chunk
+def fetch_adaptive(job, progress):
+    from concurrent.futures import ThreadPoolExecutor
+    video, audio = job["stream"], job["audio_stream"]
+    print(f"Fetching {video['resolution']}p {codec_name(video['video_codec'])} video and {audio['abr']}kbps {codec_name(audio['audio_codec'])} audio in parallel")
+    paths = {"stream": os.path.join(job["download_dir"], job["filename"]), "audio_stream": os.path.join(job["download_dir"], job["audio_filename"])}
+    done = {key: 0 for key in paths}
+    lock = threading.Lock()
+    def fetch(key):
+        def report(bytes_done, total):
+            with lock:
+                done[key] = bytes_done
+                current = sum(done.values())
+            if progress:
+                progress(current, (video["filesize"] or 0) + (audio["filesize"] or 0) or None)
+        with_fresh_stream(job, lambda stream: get_downloader().download(stream["url"], paths[key], size=stream["filesize"], progress=report), key)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for future in [executor.submit(fetch, key) for key in paths]:
+            future.result()
+    job["bytes"] = sum(os.path.getsize(path) for path in paths.values())
+    print(f"Muxing into {job['extension'].upper()}...")
+    job["transcode"] = ((paths["stream"], paths["audio_stream"]), job["output_path"], job["codec_args"])
+def fetch_video(job):
+    progress = progress_reporter(job)
+    print(f"\nNow downloading: {job['title']}")
+    print(f"Saving as: {job['final_filename']}")
+    print(f"URL: {job['link']}")
+    if job["audio_stream"] is not None:
+        fetch_adaptive(job, progress)
+        return
+    if job["codec_args"] is None:
+        with_fresh_stream(job, lambda stream: get_downloader().download(stream["url"], job["output_path"], size=stream["filesize"], progress=progress))
+        job["bytes"] = os.path.getsize(job["output_path"])
+        return
+    if get_config()["settings"].get("streaming_transcode", True):
+        print(f"Streaming to {job['extension'].upper()}...")
+        try:
+            with get_encode_slots():
+                with_fresh_stream(job, lambda stream: stream_to_file(count_bytes(job, get_downloader().iter_chunks(stream["url"], stream["filesize"]), progress),
+                                                                    job["output_path"], job["codec_args"]))
+        except Exception as e:
+            raise DownloadError(f"Error converting audio: {str(e)}")
+        return
+    temp_path = os.path.join(job["download_dir"], job["filename"])
+    with_fresh_stream(job, lambda stream: get_downloader().download(stream["url"], temp_path, size=stream["filesize"], progress=progress))
+    job["bytes"] = os.path.getsize(temp_path)
+    print(f"Converting to {job['extension'].upper()}...")
+    job["transcode"] = (temp_path, job["output_path"], job["codec_args"])
+def publish_output(job):
+    # links the finished output to its title without replacing anything; another node writing into the same
+    # shared folder may have taken the name since it was picked, and then the next free name is used
+    if job.get("published") or not os.path.exists(job["output_path"]):
+        return
+    original = job["final_filename"]
+    with filename_index.lock:
+        while True:
+            try:
+                publish_file(job["output_path"], job["final_path"])
+                break
+            except FileExistsError:
+                job["final_filename"] = filename_index.unique_name(job["download_dir"], original)
+                job["final_path"] = os.path.join(job["download_dir"], job["final_filename"])
+                # reserved until the job is released, which then records it as taken either way
+                filename_index.reserve(job["final_path"])
+                job["reserved"].append(job["final_path"])
+    job["published"] = True
+    if job["final_filename"] != original:
+        print(f"{original} was taken meanwhile, saved as {job['final_filename']}")
+def release_job(job):
+    filename_index.release(*job["reserved"])
+def download_single_video(link, as_audio=True, download_path=None, attempt=0):
+    recorder = get_run_recorder()
+    job = None
+    try:
+        job = recorder.measure("resolve", link, attempt, None, profiled(resolve_video), link, as_audio, download_path)
+        if job is None:
             return
-        temp_filename = os.path.splitext(video_title)[0] + '_temp'
-        full_path = os.path.join(download_dir, video_title)
-        if len(full_path.encode('utf-8')) >= 255:
-            video_title = clean_filename(original_title, max_length=100)
-            video_title = get_unique_filename(download_dir, video_title)
-        print(f"\nNow downloading: {original_title}")
-        print(f"Saving as: {final_filename}")
-        print(f"URL: {link}")
-        if as_audio:
-            stream = youtubeObject.streams.get_audio_only()
-            temp_path = os.path.join(download_dir, temp_filename)
-            final_path = os.path.join(download_dir, final_filename)
-            stream.download(output_path=download_dir, filename=temp_filename)
-            print("Converting to MP3...")
-            convert_to_mp3(temp_path, final_path)
-        else:
-            stream = youtubeObject.streams.get_highest_resolution()
-            stream.download(output_path=download_dir, filename=video_title)
+        recorder.measure("download", link, attempt, job, profiled(fetch_video), job)
+        if job.get("transcode"):
+            recorder.measure("transcode", link, attempt, job, profiled(convert_audio), *job["transcode"])
+        publish_output(job)
+        archive_job(job)
         print("Downloaded and converted successfully")
         print("-" * 30)
     except Exception as e:
         error_msg = f"Error downloading {link}: {str(e)}"
         print(error_msg)
-        raise DownloadError(error_msg)
+        raise DownloadError(error_msg) from e
+    finally:
+        if job is not None:
+            release_job(job)
+def get_retry_policy():
+    settings = get_config()["settings"]
+    return RetryPolicy(max_attempts=settings["max_retry_attempt"],
+                       base_delay=settings.get("retry_base_delay", 1),
+                       max_delay=settings.get("retry_max_delay", 60),
+                       throttle_delay=settings.get("retry_throttle_delay", 30))
+def download_with_retry(link, as_audio=True, download_path=None, cancel_event=None, progress=None, on_retry=None):
+    # cancel_event stops the download at the next chunk or during a retry backoff with DownloadCancelled;
+    # progress(job, bytes_done, total) and on_retry(link, attempt, max_attempts, error, kind, delay) report back
+    attempts = [0]
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+    def report(job, bytes_done, total):
+        if cancelled():
+            raise DownloadCancelled("Cancelled")
+        if progress:
+            progress(job, bytes_done, total)
+    def retry(attempt, max_attempts, error, kind, delay):
+        # a cancelled download would otherwise be classified as transient and retried
+        if cancelled():
+            raise DownloadCancelled("Cancelled") from error
+        attempts[0] = attempt
+        (on_retry or print_retry)(link, attempt, max_attempts, error, kind, delay)
+    def wait(delay):
+        if cancel_event is None:
+            time.sleep(delay)
+        elif cancel_event.wait(delay):
+            raise DownloadCancelled("Cancelled")
+    hooked = cancel_event is not None or progress is not None
+    if hooked:
+        set_progress_callback(report)
+    try:
+        get_retry_policy().call(lambda: download_single_video(link, as_audio, download_path, attempts[0]), on_retry=retry, wait=wait)
+    finally:
+        if hooked:
+            set_progress_callback(None)
+def print_retry(url, attempt, max_attempts, error, kind, delay):
+    print(f"\nError downloading {url}: {str(error)}")
+    print(f"Retrying ({attempt}/{max_attempts}) in {delay:.1f}s after {kind} error")
+def print_pipeline_stats(stats):
+    print(f"Pipeline finished in {stats['elapsed_seconds']}s")
+    for stage, stage_stats in stats["stages"].items():
+        print(f"{stage}: workers={stats['workers'][stage]} completed={stage_stats['completed']} failed={stage_stats['failed']} "
+              f"avg={stage_stats['avg_seconds']}s max={stage_stats['max_seconds']}s busy={stage_stats['busy_seconds']}s "
+              f"queue avg={stats['queue_depth'][stage]['avg']} max={stats['queue_depth'][stage]['max']}")
+    if stats["retries"]:
+        print("Retries: " + ", ".join(f"{kind}={count}" for kind, count in stats["retries"].items()))
+def print_cache_stats(stats):
+    print(f"Metadata cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, {stats['misses']} misses, "
+          f"{stats['expired']} expired, {stats['evictions']} evictions (hit rate {stats['hit_rate']:.0%})")
+def format_bytes(count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024 or unit == "GB":
+            return f"{count:.1f} {unit}"
+        count /= 1024
+def format_limits(settings):
+    download_rate = settings.get("max_download_rate") or "unlimited"
+    request_rate = settings.get("max_request_rate") or "unlimited"
+    return f"download {download_rate}, requests {request_rate}"
+def format_rate(stats):
+    download_limit = f" of {format_bytes(stats['bytes_limit'])}/s" if stats["bytes_limit"] else ""
+    request_limit = f" of {stats['requests_limit']:g}" if stats["requests_limit"] else ""
+    return f"{format_bytes(stats['bytes_per_second'])}/s{download_limit}, {stats['requests_per_second']}{request_limit} req/s"
+def print_rate_stats(stats):
+    print(f"Throughput: {format_bytes(stats['bytes'])} in {stats['requests']} requests, "
+          f"average {format_bytes(stats['average_bytes_per_second'])}/s, throttled for {stats['throttled_seconds']}s")
+def config_mtime(path=None):
+    try:
+        return os.path.getmtime(path or config_path)
+    except OSError:
+        return None
+def reload_rate_limits():
+    try:
+        reload_config()
+    except (OSError, ValueError) as e:
+        print(f"Could not reload config: {str(e)}")
+        return
+    print(f"Config reloaded, rate limits: {format_limits(get_config()['settings'])}")
+def watch_rate_limits(stop_event, on_stats=None, interval=1.0):
+    # picks up config changes, such as new rate limits, saved while a download is running
+    mtime = config_mtime()
+    while not stop_event.wait(interval):
+        current_mtime = config_mtime()
+        if current_mtime != mtime:
+            mtime = current_mtime
+            reload_rate_limits()
+        if on_stats:
+            on_stats(get_rate_limiter().stats())
+def start_rate_watcher(on_stats=None):
+    stop_event = threading.Event()
+    threading.Thread(target=watch_rate_limits, args=(stop_event, on_stats), daemon=True).start()
+    return stop_event
+def print_stage_summary(summary):
+    for stage, stage_stats in summary.items():
+        throughput = f" throughput={format_bytes(stage_stats['bytes_per_second'])}/s" if stage_stats["bytes_per_second"] else ""
+        print(f"{stage}: runs={stage_stats['count']} failed={stage_stats['failed']} retried={stage_stats['retries']} "
+              f"p50={stage_stats['p50_seconds']}s p90={stage_stats['p90_seconds']}s p99={stage_stats['p99_seconds']}s "
+              f"max={stage_stats['max_seconds']}s{throughput}")
+def finish_profiler(active_profiler):
+    path, report = active_profiler.stop(get_config()["app_data"].get("profile_path", "./run_profile"))
+    print(report)
+    if path:
+        print(f"Profile written to {path}")
+def create_pipeline(as_audio, download_path):
+    settings = get_config()["settings"]
+    return DownloadPipeline(
+        profiled(lambda url: resolve_video(url, as_audio, download_path)),
+        profiled(fetch_video),
+        convert_audio,
+        resolve_workers=settings.get("metadata_threads", 2),
+        download_workers=settings["parallel_threads"],
+        transcode_workers=settings.get("transcode_processes", 0),
+        queue_depth=settings.get("queue_depth", 4),
+        retry_policy=get_retry_policy(),
+        finish=publish_output,
+        cleanup=release_job,
+        on_retry=print_retry,
+        on_stage=get_run_recorder().record_job,
+    )
+def list_playlist_ids(playlist):
+    download_archive = get_archive()
+    if download_archive is None or not get_config()["settings"].get("playlist_sync", True):
+        return [video_id for video_id in map(get_video_id, playlist.video_urls) if video_id]
+    newest_first = get_config()["settings"].get("playlist_order", "oldest_first") == "newest_first"
+    delta = sync_playlist(playlist, download_archive.load_snapshot(playlist.playlist_id), newest_first)
+    download_archive.save_snapshot(playlist.playlist_id, delta["video_ids"], delta["reported_length"])
+    removed = "not checked" if delta["removed"] is None else len(delta["removed"])
+    listing = "full listing" if delta["complete"] else "listing stopped at the first known video"
+    print(f"Playlist sync: {len(delta['added'])} added, {removed} removed ({listing})")
+    return delta["video_ids"]
+def resolve_playlist(playlist):
+    cache = get_metadata_cache()
+    key = f"playlist:{playlist.playlist_id}"
+    playlist_ttl = get_config()["settings"].get("playlist_cache_ttl", 900)
+    playlist_info = cache.get(key, lambda info: time.time() - info["listed_at"] > playlist_ttl)
+    if playlist_info is None:
+        get_rate_limiter().acquire_request()
+        playlist_info = {"title": playlist.title, "video_ids": list_playlist_ids(playlist), "listed_at": time.time()}
+        cache.put(key, playlist_info)
+    else:
+        print("Playlist listing loaded from metadata cache")
+    return playlist_info
+def pending_video_urls(video_ids, as_audio, playlist_folder):
+    download_archive = get_archive()
+    kind = "audio" if as_audio else "video"
+    return [watch_url(video_id) for video_id in video_ids
+            if download_archive is None or download_archive.lookup(video_id, kind, playlist_folder) is None]
+def prefetch_metadata(video_urls):
+    # resolves every uncached manifest concurrently up front; the download stage then finds them in the cache
+    settings = get_config()["settings"]
+    concurrency = settings.get("metadata_concurrency", 32)
+    if not concurrency or len(video_urls) < 2:
+        return
+    cache = get_metadata_cache()
+    pending = {}
+    for link in video_urls:
+        video_id = get_video_id(link)
+        if cache.get(f"video:{video_id or link}", manifest_expired) is None:
+            pending[link] = video_id
+    if len(pending) < 2:
+        return
+    try:
+        youtube_class = get_async_youtube_class()
+    except ImportError as e:
+        print(f"Async metadata lookups unavailable ({str(e)}), resolving videos one at a time")
+        return
+    from async_metadata import AsyncMetadataResolver
+    started = time.perf_counter()
+    resolver = AsyncMetadataResolver(youtube_class, concurrency, get_rate_limiter().acquire_request,
+                                     client='WEB', use_oauth=settings["user_login"])
+    try:
+        results = resolver.resolve_all(pending)
+    except Exception as e:
+        # a failed prefetch only costs speed: nothing was cached, so every video is looked up again when it downloads
+        print(f"Metadata prefetch failed ({str(e)}), videos are resolved by the download stage")
+        return
+    failed = []
+    for link, result in results.items():
+        if isinstance(result, Exception):
+            # left uncached, so the download stage looks it up again and applies the retry policy
+            failed.append(link)
+        else:
+            cache.put(f"video:{pending[link] or link}", result)
+    print(f"Metadata prefetch: {len(results) - len(failed)} of {len(results)} videos resolved in {time.perf_counter() - started:.1f}s"
+          + (f", {len(failed)} left to the download stage" if failed else ""))
+def list_playlist(playlist_url, download_path=None):
+    playlist = get_playlist_class()(playlist_url)
+    playlist_info = resolve_playlist(playlist)
+    playlist_name = clean_filename(playlist_info["title"])
+    download_dir = download_path or os.getcwd()
+    playlist_folder = os.path.join(download_dir, playlist_name)
+    os.makedirs(playlist_folder, exist_ok=True)
+    # listed afresh for every playlist, so files deleted between watch passes are downloaded again
+    filename_index.rescan(playlist_folder)
+    return playlist_name, playlist_folder, playlist_info["video_ids"]
+def expand_playlist(playlist_url, as_audio=True, download_path=None, prefetch=True):
+    playlist_name, playlist_folder, video_ids = list_playlist(playlist_url, download_path)
+    video_urls = pending_video_urls(video_ids, as_audio, playlist_folder)
+    if prefetch:
+        prefetch_metadata(video_urls)
+    return playlist_name, playlist_folder, video_urls
+def download_videos(playlist_name, playlist_folder, video_urls, as_audio=True, downloaded=None):
+    from tqdm import tqdm
+    errors = {}
+    total_videos = len(video_urls)
+    print(f'\nNumber of videos in playlist "{playlist_name}": {total_videos}')
+    pipeline = create_pipeline(as_audio, playlist_folder)
+    with tqdm(total=total_videos, desc=f"Downloading: {playlist_name}") as pbar:
+        stop_watcher = start_rate_watcher(lambda stats: pbar.set_postfix_str(format_rate(stats)))
+        try:
+            for video_url, job, error in pipeline.run(video_urls):
+                if error:
+                    errors[video_url] = f"Error downloading {video_url}: {error}"
+                    print(f"\nError: giving up on {video_url}")
+                elif job is not None:
+                    archive_job(job)
+                    if downloaded is not None:
+                        downloaded[job["video_id"]] = job["final_path"]
+                    print(f"\nDownloaded and converted successfully: {job['title']}")
+                pbar.update(1)
+        finally:
+            stop_watcher.set()
+    print_pipeline_stats(pipeline.stats())
+    return errors
 def download_playlist(playlist_url, as_audio=True, download_path=None):
     errors = {}
     try:
-        playlist = Playlist(playlist_url)
-        playlist_name = clean_filename(playlist.title)
-        download_dir = download_path or os.getcwd()
-        playlist_folder = os.path.join(download_dir, playlist_name)
-        os.makedirs(playlist_folder, exist_ok=True)
-        total_videos = len(playlist.video_urls)
-        print(f'\nNumber of videos in playlist "{playlist_name}": {total_videos}')
-        with tqdm(total=total_videos, desc=f"Downloading: {playlist_name}") as pbar:
-            for video_url in playlist.video_urls:
-                for attempt in range(config["settings"]["max_retry_attempt"]):
-                    try:
-                        download_single_video(video_url, as_audio, download_path=playlist_folder)
-                        break
-                    except DownloadError as e:
-                        if attempt == config["settings"]["max_retry_attempt"] - 1:
-                            errors[video_url] = str(e)
-                            print(f"\nError: max retry attempts ({config["settings"]["max_retry_attempt"]}) reached")
-                        else:
-                            print(f"\nRetrying ({attempt + 1}/{config["settings"]["max_retry_attempt"]})")
-                            time.sleep(1)
-                pbar.update(1)
+        playlist_name, playlist_folder, video_urls = expand_playlist(playlist_url, as_audio, download_path)
+        errors.update(download_videos(playlist_name, playlist_folder, video_urls, as_audio))
     except Exception as e:
         print(f"Playlist error: {str(e)}")
         errors[playlist_url] = str(e)
     return errors
+def archived_entry(video_id, kind, path):
+    download_archive = get_archive()
+    if download_archive is None:
+        return None
+    path = os.path.abspath(path)
+    return next((entry for entry in download_archive.find(video_id, kind) if entry["path"] == path), None)
+def place_shared_content(plan, mode, kind, downloaded):
+    from shared_content import M3U, link_file, write_m3u
+    download_archive = get_archive()
+    locations = dict(plan.locations, **downloaded)
+    result = {"placed": 0, "missing": 0, "methods": {}, "bytes": 0, "disk_bytes": 0, "seconds": 0.0}
+    placed_ids = []
+    for video_id, folder in plan.placements:
+        source = locations.get(video_id)
+        if source is None or not os.path.exists(source):
+            # its download failed, or the earlier copy is gone
+            result["missing"] += 1
+            continue
+        size = os.path.getsize(source)
+        method = M3U
+        if mode != M3U:
+            target = os.path.join(folder, os.path.basename(source))
+            same_file = filename_index.exists(target) and os.path.getsize(target) == size
+            if not same_file:
+                with filename_index.lock:
+                    target = os.path.join(folder, filename_index.unique_name(folder, os.path.basename(source)))
+                    filename_index.reserve(target)
+                try:
+                    method = link_file(source, target, mode)
+                finally:
+                    filename_index.release(target)
+            else:
+                method = "existing"
+            source_entry = archived_entry(video_id, kind, source)
+            # a file already at the target is only this video's if it is the source itself
+            known = method != "existing" or os.path.samefile(source, target)
+            if download_archive is not None and source_entry is not None and known:
+                download_archive.record(video_id, kind, target, source_entry["format"], source_entry["title"])
+        result["placed"] += 1
+        result["methods"][method] = result["methods"].get(method, 0) + 1
+        result["bytes"] += size
+        if method not in ("copy", "existing"):
+            result["disk_bytes"] += size
+        placed_ids.append(video_id)
+    # estimated from this run's timings; videos fetched in earlier runs count at this run's average
+    item_seconds = get_run_recorder().item_seconds(("download", "transcode"))
+    average = sum(item_seconds.values()) / len(item_seconds) if item_seconds else 0.0
+    result["seconds"] = sum(item_seconds.get(watch_url(video_id), average) for video_id in placed_ids)
+    if mode == M3U:
+        for name, folder in plan.sources:
+            entries = []
+            for video_id in plan.entries[folder]:
+                entry = download_archive.lookup(video_id, kind, folder) if download_archive is not None else None
+                file_path = entry["path"] if entry is not None else locations.get(video_id)
+                if file_path is not None and os.path.exists(file_path):
+                    title = entry["title"] if entry is not None else None
+                    entries.append((title or os.path.splitext(os.path.basename(file_path))[0], file_path))
+            write_m3u(os.path.join(folder, f"{name}.m3u8"), entries)
+    return result
+def print_content_plan(counts):
+    print(f"Shared content plan: {counts['entries']} entries in {counts['sources']} playlists, {counts['unique']} unique videos: "
+          f"{counts['fetch']} to download, {counts['place']} to place from another copy ({counts['reused']} from earlier runs), "
+          f"{counts['present']} already in place")
+def print_content_savings(result):
+    methods = ", ".join(f"{method} {count}" for method, count in result["methods"].items()) or "none"
+    print(f"Shared content: placed {result['placed']} ({methods}), {result['missing']} not placed; saved {format_bytes(result['bytes'])} "
+          f"of downloads, {format_bytes(result['disk_bytes'])} of disk and ~{result['seconds']:.1f}s of download and conversion")
+def download_shared_playlists(playlist_urls, as_audio=True, download_path=None):
+    # plans all playlists together, so a video that is in several of them is downloaded and converted once
+    from shared_content import MODES, plan_shared_content
+    mode = get_config()["settings"].get("shared_content")
+    if mode not in MODES:
+        raise DownloadError(f"Unknown shared_content mode {mode!r}, expected one of {', '.join(MODES)}")
+    kind = "audio" if as_audio else "video"
+    errors = {}
+    sources = []
+    for playlist_url in playlist_urls:
+        try:
+            sources.append(list_playlist(playlist_url, download_path))
+        except Exception as e:
+            print(f"Playlist error: {str(e)}")
+            errors[playlist_url] = str(e)
+    plan = plan_shared_content(sources, get_archive(), kind)
+    print_content_plan(plan.counts())
+    prefetch_metadata([watch_url(video_id) for video_ids in plan.fetch.values() for video_id in video_ids])
+    downloaded = {}
+    for name, folder in plan.sources:
+        video_urls = [watch_url(video_id) for video_id in plan.fetch[folder]]
+        if video_urls:
+            errors.update(download_videos(name, folder, video_urls, as_audio, downloaded))
+    print_content_savings(place_shared_content(plan, mode, kind, downloaded))
+    return errors
 def main():
     script_directory = os.path.dirname(os.path.abspath(__file__))
     os.chdir(script_directory)
     try:
+        active_profiler = get_profiler()
+        if active_profiler is not None:
+            active_profiler.start()
         print("-" * 30)
-        print(json.dumps(config, indent=4))
+        print(json.dumps(get_config(), indent=4))
         print("-" * 30)
-        download_path = config["app_data"]["download_path"]
-        is_playlist = config["settings"]["is_playlist"]
-        audio_only = config["settings"]["audio_only"]
+        download_path = get_config()["app_data"]["download_path"]
+        is_playlist = get_config()["settings"]["is_playlist"]
+        audio_only = get_config()["settings"]["audio_only"]
         all_errors = {}
         if is_playlist:
-            playlist_links = config["app_data"]["playlist_url"]
+            playlist_links = get_config()["app_data"]["playlist_url"]
             print(f'Number of playlists: {len(playlist_links)}')
-            for idx, playlist_url in enumerate(playlist_links, 1):
-                print(f"\nDownloading playlist [{idx}/{len(playlist_links)}]")
-                errors = download_playlist(playlist_url, audio_only, download_path)
-                if errors:
-                    all_errors.update(errors)
+            if get_config()["settings"].get("shared_content") and len(playlist_links) > 1:
+                all_errors.update(download_shared_playlists(playlist_links, audio_only, download_path))
+            else:
+                for idx, playlist_url in enumerate(playlist_links, 1):
+                    print(f"\nDownloading playlist [{idx}/{len(playlist_links)}]")
+                    errors = download_playlist(playlist_url, audio_only, download_path)
+                    if errors:
+                        all_errors.update(errors)
             if all_errors:
                 print("\nEncountered errors:")
                 print("-" * 30)
@@ -160,11 +788,20 @@ def main():
                     print(f"Error: {error}")
                 print("-" * 30)
         else:
-            for url in config["app_data"]["single_url"]:
+            for url in get_config()["app_data"]["single_url"]:
                 try:
-                    download_single_video(url, audio_only, download_path)
+                    download_with_retry(url, audio_only, download_path)
                 except DownloadError as e:
                     all_errors[url] = str(e)
+        print_cache_stats(get_metadata_cache().stats())
+        print_rate_stats(get_rate_limiter().stats())
+        recorder = get_run_recorder()
+        print_stage_summary(recorder.summary())
+        recorder.close()
+        if recorder.path:
+            print(f"Run report: {recorder.path}")
+        if active_profiler is not None:
+            finish_profiler(active_profiler)
     except Exception as e:
         print(f"Fatal error: {str(e)}")
     print("\n-------------- Download finished --------------")
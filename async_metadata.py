@@ -0,0 +1,61 @@
+import asyncio, threading
+from metadata_cache import manifest_from_async_youtube
+
+# pytubefix keeps one AsyncHTTPClient per process, bound to the event loop that last opened it,
+# so concurrent resolve_all() calls (the daemon and UI expand playlists on several threads) take turns
+resolve_lock = threading.Lock()
+
+
+class AsyncMetadataResolver:
+    """Resolves many video manifests concurrently on one event loop.
+
+    Looking up a video is almost all network wait, so instead of one
+    blocking YouTube(...) per item, up to ``concurrency`` AsyncYouTube
+    lookups are in flight at once over a single pooled HTTP client.
+    ``acquire_request`` (the shared rate limiter) is called before each
+    lookup in a worker thread, so the request cap still holds. Only one
+    resolve_all() runs at a time in a process, since the HTTP client is
+    shared.
+    """
+
+    def __init__(self, youtube_class, concurrency=32, acquire_request=None, http_client=None, **youtube_kwargs):
+        self.youtube_class = youtube_class
+        self.concurrency = max(1, concurrency)
+        self.acquire_request = acquire_request
+        self.http_client = http_client
+        self.youtube_kwargs = youtube_kwargs
+
+    def resolve_all(self, links):
+        """links maps each URL to its video ID. Returns {link: manifest or the exception its lookup raised}."""
+        with resolve_lock:
+            return asyncio.run(self._resolve_all(links))
+
+    async def _resolve_all(self, links):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+        clients = {}
+
+        async def resolve(link, video_id):
+            async with semaphore:
+                try:
+                    if self.acquire_request is not None:
+                        await asyncio.to_thread(self.acquire_request)
+                    youtube = self.youtube_class(link, http_client=self.http_client, **self.youtube_kwargs)
+                    client = getattr(youtube, "http_client", None)
+                    if client is not None:
+                        clients[id(client)] = client
+                    results[link] = await manifest_from_async_youtube(youtube, video_id)
+                except Exception as e:
+                    results[link] = e
+
+        try:
+            await asyncio.gather(*(resolve(link, video_id) for link, video_id in links.items()))
+        finally:
+            # pytubefix shares one AsyncHTTPClient per process; its session belongs to this event loop, which ends here
+            for client in clients.values():
+                try:
+                    await client.close()
+                except Exception:
+                    # the lookups' results are already in hand; a session that will not close is dropped with the loop
+                    pass
+        return results
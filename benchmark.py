@@ -0,0 +1,617 @@
+"""Offline benchmarks for YTDownload.py / YTDownload+.py.
+
+pytubefix's YouTube and Playlist are replaced by stand-ins backed by a
+local HTTP server that serves synthetic audio and video streams, with
+configurable latency, bandwidth and failure injection. Each scenario runs
+in its own process, so CPU time and peak RSS are per scenario. Results
+are saved as JSON; pass --compare with an earlier file to flag
+regressions.
+
+    python benchmark.py --items 20 --latency 0.05 --bandwidth 20M
+    python benchmark.py --compare benchmark_results/previous.json
+    python benchmark.py --startup-only
+    python benchmark.py --scenarios concurrent-original --nodes 1 2 4 --node-rate 8M
+
+--startup-only and --filenames-only run just the cold-start import timing
+or the clean_filename micro-benchmark. --nodes adds cluster-N scenarios:
+one playlist drained through a shared job ledger by N cluster.py worker
+processes, each capped at --node-rate as if it were a host of its own.
+"""
+import os, re, sys, json, time, asyncio, random, socket, argparse, platform, tempfile, threading, subprocess, contextlib
+import http.server, importlib.util, urllib.request
+from urllib.parse import urlsplit, parse_qs
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CHUNK_SIZE = 64 * 1024
+
+AUDIO_STREAM = {"itag": 140, "mime_type": "audio/mp4", "subtype": "mp4", "audio_codec": "mp4a.40.2", "video_codec": None,
+                "abr": "128kbps", "resolution": None, "fps": None, "bitrate": 128000, "is_progressive": False,
+                "includes_audio_track": True, "includes_video_track": False}
+VIDEO_STREAM = {"itag": 18, "mime_type": "video/mp4", "subtype": "mp4", "audio_codec": "mp4a.40.2", "video_codec": "avc1.42001E",
+                "abr": "96kbps", "resolution": "360p", "fps": 25, "bitrate": 500000, "is_progressive": True,
+                "includes_audio_track": True, "includes_video_track": True}
+ADAPTIVE_VIDEO_STREAM = {"itag": 136, "mime_type": "video/mp4", "subtype": "mp4", "audio_codec": None, "video_codec": "avc1.4d401f",
+                         "abr": None, "resolution": "720p", "fps": 25, "bitrate": 1500000, "is_progressive": False,
+                         "includes_audio_track": False, "includes_video_track": True}
+
+PATHS = {
+    "original": {"as_audio": True, "settings": {"audio_policy": "original"}},
+    "remux": {"as_audio": True, "settings": {"audio_policy": "remux"}},
+    "transcode-streaming": {"as_audio": True, "settings": {"audio_policy": "transcode", "streaming_transcode": True}},
+    "transcode-file": {"as_audio": True, "settings": {"audio_policy": "transcode", "streaming_transcode": False}},
+    "video": {"as_audio": False, "settings": {"video_streams": "progressive"}},
+    "video-adaptive": {"as_audio": False, "settings": {"video_streams": "adaptive"}},
+}
+SCENARIOS = [f"{mode}-{path}" for mode in ("sequential", "concurrent") for path in PATHS]
+HEAVY_MODULES = ("pytubefix", "aiohttp", "tqdm", "rich", "moviepy", "numpy", "PySide6", "http.client", "sqlite3")
+STARTUP_PROBE = """
+import sys, json, time, importlib.util
+started = time.perf_counter()
+sys.path.insert(0, {repo!r})
+spec = importlib.util.spec_from_file_location("startup_probe", {path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(json.dumps({{"import_ms": (time.perf_counter() - started) * 1000,
+                  "modules": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+STARTUP_NOISE_MS = 5
+FILENAME_MAX_LENGTH = 85
+FILENAME_NOISE_US = 100
+COMPARED_PARAMETERS = ("items", "duration", "latency", "bandwidth", "failure_rate", "error_rate", "threads", "node_rate")
+
+
+def generate_media(directory, duration):
+    """Writes a synthetic AAC audio stream, a progressive H.264 video stream and a video-only adaptive one with ffmpeg."""
+    sys.path.insert(0, REPO_DIR)
+    from transcode import ffmpeg_executable
+    ffmpeg = ffmpeg_executable()
+    media = {"audio": os.path.join(directory, "audio.m4a"), "video": os.path.join(directory, "video.mp4"),
+             "video-only": os.path.join(directory, "video-only.mp4")}
+    commands = {
+        "audio": ["-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}", "-c:a", "aac", "-b:a", "128k",
+                  # fragmented like YouTube's DASH audio, so it can be piped into ffmpeg
+                  "-movflags", "frag_keyframe+empty_moov+default_base_moof"],
+        "video": ["-f", "lavfi", "-i", f"testsrc=size=640x360:rate=25:duration={duration}",
+                  "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                  "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "96k", "-shortest", "-movflags", "+faststart"],
+        "video-only": ["-f", "lavfi", "-i", f"testsrc=size=1280x720:rate=25:duration={duration}",
+                       "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-an"],
+    }
+    for name, path in media.items():
+        if not os.path.exists(path):
+            subprocess.run([ffmpeg, "-y", "-loglevel", "error"] + commands[name] + [path], check=True)
+    return media
+
+
+class BackendHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        backend = self.server.backend
+        backend.count("requests")
+        if backend.latency:
+            time.sleep(backend.latency)
+        if random.random() < backend.error_rate:
+            backend.count("errors")
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        parts = urlsplit(self.path)
+        if parts.path == "/watch":
+            video_id = parse_qs(parts.query)["v"][0]
+            body = json.dumps({"video_id": video_id, "title": f"Benchmark track {video_id}"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        data = backend.data.get(parts.path.strip("/"))
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = 0, len(data) - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match[1])
+            end = min(end, int(match[2])) if match[2] else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        body = memoryview(data)[start:end + 1]
+        if len(body) > 1 and random.random() < backend.failure_rate:
+            # drop the connection halfway through the body
+            backend.count("dropped")
+            body = body[:len(body) // 2]
+            self._send(body, backend)
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self._send(body, backend)
+
+    def _send(self, body, backend):
+        started = time.monotonic()
+        for offset in range(0, len(body), CHUNK_SIZE):
+            chunk = body[offset:offset + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            backend.count("bytes_sent", len(chunk))
+            if backend.bandwidth:
+                ahead = (offset + len(chunk)) / backend.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+class FakeBackend:
+    """Local stand-in for YouTube's watch pages and googlevideo stream URLs."""
+
+    def __init__(self, media, latency=0.0, bandwidth=None, failure_rate=0.0, error_rate=0.0):
+        self.data = {}
+        for name, path in media.items():
+            with open(path, "rb") as f:
+                self.data[name] = f.read()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.server = None
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def reset(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+        return counters
+
+    def start(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), BackendHandler)
+        self.server.daemon_threads = True
+        self.server.backend = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class FakeStream:
+    def __init__(self, record, url, filesize):
+        self.__dict__.update(record)
+        self.url = url
+        self._filesize = filesize
+
+
+class FakeYouTube:
+    """Accepts the same constructor arguments as pytubefix.YouTube; fetches metadata from the fake backend."""
+    backend_url = None
+    sizes = {}
+
+    def __init__(self, url, *args, **kwargs):
+        self.watch_url = url
+        self.video_id = parse_qs(urlsplit(url).query)["v"][0]
+        self._info = None
+
+    def _fetch(self):
+        if self._info is None:
+            with urllib.request.urlopen(f"{self.backend_url}/watch?v={self.video_id}", timeout=30) as response:
+                self._info = json.load(response)
+        return self._info
+
+    @property
+    def title(self):
+        return self._fetch()["title"]
+
+    @property
+    def streams(self):
+        self._fetch()
+        expire = int(time.time()) + 6 * 3600
+        return [FakeStream(record, f"{self.backend_url}/{name}?expire={expire}&id={self.video_id}", self.sizes[name])
+                for name, record in (("audio", AUDIO_STREAM), ("video", VIDEO_STREAM), ("video-only", ADAPTIVE_VIDEO_STREAM))]
+
+
+class FakeAsyncYouTube(FakeYouTube):
+    """Stands in for pytubefix.AsyncYouTube: title() and streams() are coroutines."""
+
+    async def title(self):
+        return (await asyncio.to_thread(self._fetch))["title"]
+
+    async def streams(self):
+        await asyncio.to_thread(self._fetch)
+        return FakeYouTube.streams.fget(self)
+
+
+class FakePlaylist:
+    """Stands in for pytubefix.Playlist; the URL carries the number of items (?list=...&count=N)."""
+
+    def __init__(self, url, *args, **kwargs):
+        query = parse_qs(urlsplit(url).query)
+        self.playlist_id = query["list"][0]
+        self.title = "Benchmark"
+        self.video_urls = [f"https://www.youtube.com/watch?v=bench{index:06d}" for index in range(int(query["count"][0]))]
+        self.length = len(self.video_urls)
+
+    def url_generator(self):
+        return iter(self.video_urls)
+
+
+def load_script(path):
+    sys.path.insert(0, REPO_DIR)
+    spec = importlib.util.spec_from_file_location("ytdownload_benchmark", path)
+    module = importlib.util.module_from_spec(spec)
+    # registered so the transcode process pool can pickle the script's functions
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def resource_usage():
+    try:
+        import resource
+    except ImportError:
+        return time.process_time(), None, None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    return cpu, own.ru_maxrss * scale, children.ru_maxrss * scale
+
+
+def run_scenario(spec):
+    """Runs one scenario in this process and returns its measurements."""
+    mode, path_name = spec["scenario"].split("-", 1)
+    path = PATHS[path_name]
+    FakeYouTube.backend_url = spec["backend_url"]
+    FakeYouTube.sizes = spec["sizes"]
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        module = load_script(spec["script"])
+        module.YouTube = FakeYouTube
+        module.Playlist = FakePlaylist
+        module.AsyncYouTube = FakeAsyncYouTube
+        config = module.get_config()
+        config["settings"].update(spec["settings"])
+        config["settings"].update(path["settings"])
+        config["app_data"].update(archive_path="", metadata_cache_path="", report_path="")
+        output_dir = tempfile.mkdtemp(prefix="ytdownload-benchmark-")
+        playlist_url = f"{spec['backend_url']}/playlist?list=BENCH&count={spec['items']}"
+        cpu_before = resource_usage()[0]
+        started = time.perf_counter()
+        if mode == "sequential":
+            failed = 0
+            for url in FakePlaylist(playlist_url).video_urls:
+                try:
+                    module.download_with_retry(url, path["as_audio"], output_dir)
+                except module.DownloadError:
+                    failed += 1
+        else:
+            failed = len(module.download_playlist(playlist_url, path["as_audio"], output_dir))
+        seconds = time.perf_counter() - started
+    cpu_after, peak_rss, children_peak_rss = resource_usage()
+    return {
+        "seconds": round(seconds, 3),
+        "failed": failed,
+        "cpu_seconds": round(cpu_after - cpu_before, 3),
+        "peak_rss_mb": round(peak_rss / 1e6, 1) if peak_rss is not None else None,
+        "children_peak_rss_mb": round(children_peak_rss / 1e6, 1) if children_peak_rss is not None else None,
+    }
+
+
+def run_node(spec):
+    """Runs one cluster worker in this process until the ledger is drained."""
+    FakeYouTube.backend_url = spec["backend_url"]
+    FakeYouTube.sizes = spec["sizes"]
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        sys.path.insert(0, REPO_DIR)
+        # cluster.py runs jobs through the YTDownload module, so that is the one patched
+        import YTDownload as module
+        import cluster
+        module.YouTube = FakeYouTube
+        module.Playlist = FakePlaylist
+        module.AsyncYouTube = FakeAsyncYouTube
+        config = module.get_config()
+        config["settings"].update(spec["settings"])
+        config["app_data"].update(archive_path="", metadata_cache_path="", report_path="")
+        cluster.work(cluster.open_ledger(spec["ledger"], spec["node"]), config["settings"]["parallel_threads"], False, 0.5)
+
+
+def run_cluster(spec, nodes, timeout):
+    """Queues one playlist in a fresh ledger and drains it with nodes worker processes; returns measurements like run_scenario."""
+    from job_store import JobStore, FAILED
+    work_dir = tempfile.mkdtemp(prefix="ytdownload-benchmark-cluster-")
+    ledger = JobStore(os.path.join(work_dir, "ledger.db"), owner="benchmark")
+    playlist_url = f"{spec['backend_url']}/playlist?list=BENCH&count={spec['items']}"
+    ledger.add(playlist_url, "playlist", PATHS["original"]["as_audio"], os.path.join(work_dir, "downloads"))
+    cpu_before = resource_usage()[0]
+    started = time.perf_counter()
+    processes = []
+    for index in range(nodes):
+        # stderr goes to a file, since the workers run side by side and nobody reads a pipe until they exit
+        stderr = tempfile.TemporaryFile("w+")
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--run-node"], stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL, stderr=stderr, text=True, cwd=tempfile.gettempdir())
+        process.stdin.write(json.dumps(dict(spec, ledger=ledger.path, node=f"node{index}")))
+        process.stdin.close()
+        processes.append((process, stderr))
+    for process, stderr in processes:
+        try:
+            process.wait(timeout=max(1, timeout - (time.perf_counter() - started)))
+        except subprocess.TimeoutExpired:
+            for other, _ in processes:
+                other.kill()
+            raise RuntimeError(f"{spec['scenario']} did not finish in {timeout}s")
+        stderr.seek(0)
+        if process.returncode != 0:
+            raise RuntimeError(f"{spec['scenario']} failed:\n{stderr.read()[-2000:]}")
+        stderr.close()
+    seconds = time.perf_counter() - started
+    failed = ledger.counts().get(FAILED, 0)
+    ledger.close()
+    return {
+        "seconds": round(seconds, 3),
+        # the playlist job fails along with its videos
+        "failed": max(0, failed - 1),
+        "cpu_seconds": round(resource_usage()[0] - cpu_before, 3),
+        "peak_rss_mb": None,
+        "children_peak_rss_mb": None,
+    }
+
+
+def run_in_subprocess(spec, timeout):
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scenario"], input=json.dumps(spec),
+                             capture_output=True, text=True, timeout=timeout, cwd=tempfile.gettempdir())
+    if process.returncode != 0:
+        raise RuntimeError(f"{spec['scenario']} failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def measure_startup(path, repeats):
+    """Cold-start cost of importing a script in a fresh interpreter: median import and whole-process time."""
+    import_times, process_times, modules = [], [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        process = subprocess.run([sys.executable, "-c", STARTUP_PROBE.format(repo=REPO_DIR, path=path, heavy=HEAVY_MODULES)],
+                                 capture_output=True, text=True, cwd=tempfile.gettempdir())
+        process_times.append((time.perf_counter() - started) * 1000)
+        if process.returncode != 0:
+            raise RuntimeError(f"Importing {path} failed:\n{process.stderr[-2000:]}")
+        probe = json.loads(process.stdout.strip().splitlines()[-1])
+        import_times.append(probe["import_ms"])
+        modules = probe["modules"]
+    return {
+        "target": os.path.basename(path),
+        "import_ms": round(sorted(import_times)[len(import_times) // 2], 1),
+        "process_ms": round(sorted(process_times)[len(process_times) // 2], 1),
+        "heavy_modules": modules,
+    }
+
+
+def startup_targets(script):
+    targets = [os.path.abspath(script)]
+    # UI.py can only be imported where PySide6 is installed
+    if importlib.util.find_spec("PySide6") is not None:
+        targets.append(os.path.join(REPO_DIR, "UI.py"))
+    return targets
+
+
+def filename_corpus():
+    """Titles that are slow or awkward to clean: very long CJK, emoji and ZWJ sequences, combining marks, control and forbidden characters."""
+    random.seed(0)
+    corpus = [
+        "日本語のタイトル" * 500,
+        "😀👨‍👩‍👧‍👦🏳️‍🌈" * 400,
+        "e\u0301\u0302\u0303" * 1000,
+        "ｆｕｌｌｗｉｄｔｈ　ｔｉｔｌｅ" * 300,
+        '\\/:*?"<>|\'' * 500,
+        "".join(chr(code) for code in range(32)) * 100 + "title",
+        "a" * 10000,
+        "Song Title (Official Music Video) [4K Remaster] | Artist feat. Someone",
+    ]
+    alphabet = 'ab /:*?"<>|\x00\x07\u200b\u0301日本😀👨‍👩‍👧.ｆ'
+    corpus += ["".join(random.choice(alphabet) for _ in range(random.randint(50, 2000))) for _ in range(200)]
+    return corpus
+
+
+def measure_filenames(repeats):
+    """Microseconds per sanitize_filename call over filename_corpus(), uncached and from the cache."""
+    sys.path.insert(0, REPO_DIR)
+    from sanitize import sanitize_filename
+    corpus = filename_corpus()
+    uncached, cached, slowest = [], [], 0.0
+    for _ in range(repeats):
+        sanitize_filename.cache_clear()
+        started = time.perf_counter()
+        for title in corpus:
+            title_started = time.perf_counter()
+            sanitize_filename(title, FILENAME_MAX_LENGTH, "...")
+            slowest = max(slowest, time.perf_counter() - title_started)
+        uncached.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        for title in corpus:
+            sanitize_filename(title, FILENAME_MAX_LENGTH, "...")
+        cached.append(time.perf_counter() - started)
+    return {
+        "titles": len(corpus),
+        "characters": sum(len(title) for title in corpus),
+        "uncached_us": round(min(uncached) * 1e6 / len(corpus), 2),
+        "cached_us": round(min(cached) * 1e6 / len(corpus), 2),
+        "slowest_title_us": round(slowest * 1e6, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=REPO_DIR).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, startup, filenames, current_parameters, previous, tolerance):
+    """Prints items/min, import time and filename cleaning time against a previous run; returns what got slower than tolerance."""
+    previous_results = {result["scenario"]: result for result in previous["results"]}
+    changed = [key for key in COMPARED_PARAMETERS if previous.get("parameters", {}).get(key) != current_parameters.get(key)]
+    if changed:
+        print(f"Note: runs used different {', '.join(changed)}; the comparison is not like for like")
+    regressions = []
+    for result in results:
+        old = previous_results.get(result["scenario"])
+        if not old or not old["items_per_minute"]:
+            continue
+        change = result["items_per_minute"] / old["items_per_minute"] - 1
+        marker = ""
+        if change < -tolerance:
+            regressions.append(result["scenario"])
+            marker = "  REGRESSION"
+        print(f"{result['scenario']:<32} {old['items_per_minute']:>9.1f} -> {result['items_per_minute']:>9.1f} items/min ({change:+.1%}){marker}")
+    previous_startup = {entry["target"]: entry for entry in previous.get("startup", [])}
+    for entry in startup:
+        old = previous_startup.get(entry["target"])
+        if not old:
+            continue
+        marker = ""
+        if entry["import_ms"] > old["import_ms"] * (1 + tolerance) and entry["import_ms"] - old["import_ms"] > STARTUP_NOISE_MS:
+            regressions.append(f"import {entry['target']}")
+            marker = "  REGRESSION"
+        print(f"{'import ' + entry['target']:<32} {old['import_ms']:>9.1f} -> {entry['import_ms']:>9.1f} ms{marker}")
+    old = previous.get("filenames")
+    if filenames and old:
+        marker = ""
+        if filenames["uncached_us"] > old["uncached_us"] * (1 + tolerance) and filenames["uncached_us"] - old["uncached_us"] > FILENAME_NOISE_US:
+            regressions.append("clean_filename")
+            marker = "  REGRESSION"
+        print(f"{'clean_filename':<32} {old['uncached_us']:>9.1f} -> {filenames['uncached_us']:>9.1f} us/title{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a local fake YouTube backend.")
+    parser.add_argument("--script", default=os.path.join(REPO_DIR, "YTDownload.py"), help="script to benchmark")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--items", type=int, default=20, help="videos per scenario")
+    parser.add_argument("--duration", type=int, default=60, help="length of the synthetic streams in seconds")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument("--bandwidth", default=None, help="per-connection cap, e.g. 20M (bytes/s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of responses dropped mid-body")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 503")
+    parser.add_argument("--threads", type=int, default=5, help="parallel_threads for concurrent scenarios")
+    parser.add_argument("--nodes", type=int, nargs="*", default=[], help="also run cluster scenarios with these worker process counts")
+    parser.add_argument("--node-rate", default="8M", help="max_download_rate of each cluster worker process (bytes/s)")
+    parser.add_argument("--output", default=None, help="results file (default benchmark_results/<time>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed items/min drop before --compare fails")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds allowed per scenario")
+    parser.add_argument("--startup-repeats", type=int, default=5, help="fresh interpreters per cold-start measurement")
+    parser.add_argument("--startup-only", action="store_true", help="only measure cold-start import time")
+    parser.add_argument("--filenames-only", action="store_true", help="only run the clean_filename micro-benchmark")
+    parser.add_argument("--run-scenario", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--run-node", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(json.load(sys.stdin))))
+        return 0
+    if args.run_node:
+        run_node(json.load(sys.stdin))
+        return 0
+
+    filenames = measure_filenames(max(1, args.startup_repeats))
+    print(f"{'clean_filename':<32} {filenames['uncached_us']:>9.1f} us/title uncached {filenames['cached_us']:>6.2f} us cached "
+          f"slowest {filenames['slowest_title_us']:.1f} us ({filenames['titles']} titles, {filenames['characters']} chars)")
+    startup = []
+    for target in startup_targets(args.script) if not args.filenames_only else []:
+        entry = measure_startup(target, max(1, args.startup_repeats))
+        startup.append(entry)
+        print(f"{'import ' + entry['target']:<32} {entry['import_ms']:>9.1f} ms import {entry['process_ms']:>8.1f} ms process "
+              f"loaded: {', '.join(entry['heavy_modules']) or 'none'}")
+    results = []
+    if not args.startup_only and not args.filenames_only:
+        results = run_scenarios(args)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "script": os.path.basename(args.script),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("run_scenario", "run_node", "compare", "output")},
+        "startup": startup,
+        "filenames": filenames,
+        "results": results,
+    }
+    output = args.output or os.path.join(REPO_DIR, "benchmark_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, startup, filenames, report["parameters"], json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} measurement(s) slower than the {args.tolerance:.0%} tolerance")
+            return 1
+    return 0
+
+
+def run_scenarios(args):
+    sys.path.insert(0, REPO_DIR)
+    from rate_limit import parse_rate
+    media_dir = os.path.join(tempfile.gettempdir(), f"ytdownload-benchmark-media-v2-{args.duration}s")
+    os.makedirs(media_dir, exist_ok=True)
+    backend = FakeBackend(generate_media(media_dir, args.duration), args.latency, parse_rate(args.bandwidth),
+                          args.failure_rate, args.error_rate)
+    backend_url = backend.start()
+    sizes = {name: len(data) for name, data in backend.data.items()}
+    settings = {"retry_base_delay": 0.1, "retry_max_delay": 2, "retry_throttle_delay": 0.5,
+                "metadata_cache_ttl": 3600, "max_download_rate": None, "max_request_rate": None}
+    results = []
+    try:
+        for scenario in args.scenarios + [f"cluster-{nodes}" for nodes in args.nodes]:
+            mode = scenario.split("-", 1)[0]
+            scenario_settings = dict(settings)
+            if mode == "sequential":
+                scenario_settings.update(parallel_threads=1, metadata_threads=1, transcode_processes=1)
+            else:
+                scenario_settings.update(parallel_threads=args.threads)
+            if mode == "cluster":
+                scenario_settings.update(PATHS["original"]["settings"], max_download_rate=args.node_rate)
+            spec = {"scenario": scenario, "script": os.path.abspath(args.script), "backend_url": backend_url,
+                    "sizes": sizes, "items": args.items, "settings": scenario_settings}
+            backend.reset()
+            if mode == "cluster":
+                measured = run_cluster(spec, int(scenario.split("-", 1)[1]), args.timeout)
+            else:
+                measured = run_in_subprocess(spec, args.timeout)
+            counters = backend.reset()
+            megabytes = counters.get("bytes_sent", 0) / 1e6
+            result = {
+                "scenario": scenario,
+                "items": args.items,
+                **measured,
+                "items_per_minute": round((args.items - measured["failed"]) * 60 / measured["seconds"], 1) if measured["seconds"] else None,
+                "megabytes": round(megabytes, 2),
+                "megabytes_per_second": round(megabytes / measured["seconds"], 2) if measured["seconds"] else None,
+                "requests": counters.get("requests", 0),
+                "injected_failures": counters.get("dropped", 0) + counters.get("errors", 0),
+            }
+            results.append(result)
+            print(f"{scenario:<32} {result['items_per_minute']:>9.1f} items/min {result['megabytes_per_second']:>8.2f} MB/s "
+                  f"cpu {result['cpu_seconds']:>7.2f}s rss {result['peak_rss_mb'] or '-'} MB failed {result['failed']}")
+    finally:
+        backend.stop()
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(main())
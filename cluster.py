@@ -0,0 +1,172 @@
+"""Spreads a download backlog across several processes or hosts through a shared job ledger.
+
+The ledger is a job store in SQLite (app_data.cluster_ledger_path) on
+storage every node can reach, next to the shared download_path. The
+coordinator queues the configured playlists; workers lease jobs from the
+ledger, expand playlists into one job per video and run each video
+through the normal download path into its folder, renewing their leases
+every few seconds while they work. A job whose lease has not been renewed
+for cluster_lease_seconds, because its worker crashed or lost the share,
+is queued again for the next worker that claims.
+
+    python cluster.py coordinate --wait     queue playlist_url (or single_url) and follow progress
+    python cluster.py work --workers 4      run jobs until the ledger is drained (--follow keeps waiting)
+    python cluster.py status                job counts and throughput per worker
+
+Several workers on one machine, each started with `work`, behave like
+several hosts, which is how the setup can be tried locally.
+"""
+import os, sys, time, signal, socket, argparse
+
+from YTDownload import get_config, get_metadata_cache, get_rate_limiter, get_run_recorder, print_cache_stats, print_rate_stats
+from daemon import DownloadDaemon
+from job_store import JobStore, QUEUED, RUNNING, WAITING, DONE, FAILED, CANCELLED
+
+STATUSES = (QUEUED, RUNNING, WAITING, DONE, FAILED, CANCELLED)
+
+
+def open_ledger(path, owner):
+    return JobStore(path, owner=owner, lease_seconds=get_config()["settings"].get("cluster_lease_seconds", 60))
+
+
+def use_node_databases(node):
+    """Gives this node its own download archive and metadata cache.
+
+    Both are SQLite databases in WAL mode, which is only safe for
+    processes on one host; with the script on the share, every node would
+    otherwise open the same files next to it.
+    """
+    app_data = get_config()["app_data"]
+    for key in ("archive_path", "metadata_cache_path"):
+        if app_data.get(key):
+            root, extension = os.path.splitext(app_data[key])
+            app_data[key] = f"{root}.{node}{extension}"
+
+
+def drained(counts):
+    return not any(counts.get(status) for status in (QUEUED, RUNNING, WAITING))
+
+
+def format_counts(counts):
+    return ", ".join(f"{counts.get(status, 0)} {status}" for status in STATUSES)
+
+
+def print_status(store):
+    print(f"Jobs: {format_counts(store.counts())}")
+    now = time.time()
+    for owner, worker in sorted(store.workers().items()):
+        done = worker.get(DONE, 0)
+        seconds = (worker["finished_at"] or now) - (worker["started_at"] or now)
+        rate = f"{done * 60 / seconds:.1f} videos/min" if done and seconds > 0 else "-"
+        print(f"  {owner}: {done} done, {worker.get(FAILED, 0)} failed, {worker.get(RUNNING, 0)} running, {rate}")
+
+
+def print_failures(store):
+    failed = [job for job in store.list(status=FAILED, limit=1000) if job["kind"] == "video"]
+    if not failed:
+        return
+    print("\nEncountered errors:")
+    print("-" * 30)
+    for job in failed:
+        print(f"URL: {job['url']}")
+        print(f"Error: {job['error']}")
+    print("-" * 30)
+
+
+def coordinate(store, wait, interval):
+    config = get_config()
+    settings = config["settings"]
+    if settings["is_playlist"]:
+        urls, kind = config["app_data"]["playlist_url"], "playlist"
+    else:
+        urls, kind = config["app_data"]["single_url"], "video"
+    started = time.time()
+    added = 0
+    for url in urls:
+        # an unfinished job for the same URL is kept, so running the coordinator twice queues nothing new
+        job = store.add(url, kind, settings["audio_only"], config["app_data"]["download_path"], unique=True)
+        if job["created_at"] >= started:
+            added += 1
+    print(f"Queued {added} {kind} jobs in {store.path} ({len(urls) - added} already queued)")
+    if not wait:
+        return
+    last = None
+    while True:
+        # expired leases are reclaimed here too, in case every worker holding them is gone
+        store.reclaim_expired()
+        counts = store.counts()
+        if counts != last:
+            print(f"[{time.strftime('%H:%M:%S')}] {format_counts(counts)}")
+            last = counts
+        if drained(counts):
+            break
+        time.sleep(interval)
+    print_status(store)
+    print_failures(store)
+
+
+def work(store, workers, follow, interval):
+    # jobs queued by other processes wake nobody here, so an idle worker checks the ledger every second
+    daemon = DownloadDaemon(store, workers, prefetch=False, poll_interval=1)
+    daemon.start()
+    print(f"Worker {store.owner} running {workers} downloads at once from {store.path}")
+    try:
+        while True:
+            time.sleep(interval)
+            daemon.renew_leases()
+            if not follow and drained(store.counts()):
+                break
+    except KeyboardInterrupt:
+        daemon.stop()
+        print("Stopping; jobs this worker was running are taken over by others once their lease runs out")
+    else:
+        # nothing is left to claim, so the threads are only waiting for work
+        daemon.stop()
+        for thread in daemon.threads:
+            thread.join()
+    worker = store.workers().get(store.owner, {})
+    print(f"Worker {store.owner}: {worker.get(DONE, 0)} videos done, {worker.get(FAILED, 0)} failed")
+    print_cache_stats(get_metadata_cache().stats())
+    print_rate_stats(get_rate_limiter().stats())
+    get_run_recorder().close()
+
+
+def main():
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    config = get_config()
+    parser = argparse.ArgumentParser(description="Spread downloads across processes or hosts through a shared job ledger.")
+    parser.add_argument("--ledger", default=config["app_data"].get("cluster_ledger_path", "./cluster_ledger.db"),
+                        help="job ledger database, on storage every node can reach")
+    commands = parser.add_subparsers(dest="command", required=True)
+    coordinate_parser = commands.add_parser("coordinate", help="queue the configured playlists (or single_url videos)")
+    coordinate_parser.add_argument("--wait", action="store_true", help="follow progress until the ledger is drained")
+    work_parser = commands.add_parser("work", help="run jobs from the ledger")
+    work_parser.add_argument("--workers", type=int, default=config["settings"]["parallel_threads"], help="downloads run at once")
+    work_parser.add_argument("--id", default=None, help="name of this worker in the ledger (default <host>-<pid>)")
+    work_parser.add_argument("--follow", action="store_true", help="keep waiting for new jobs once the ledger is drained")
+    commands.add_parser("status", help="print job counts and throughput per worker")
+    args = parser.parse_args()
+
+    node = f"{socket.gethostname()}-{os.getpid()}"
+    lease_seconds = config["settings"].get("cluster_lease_seconds", 60)
+    # leases are renewed well before they run out, and a drained ledger is noticed within a few seconds
+    interval = max(1.0, min(5.0, lease_seconds / 3))
+    if args.command == "work":
+        # per host rather than per worker, so a restarted worker keeps its archive and cache
+        use_node_databases(socket.gethostname())
+        store = open_ledger(args.ledger, args.id or node)
+        # SIGTERM stops the worker like Ctrl+C; its leases run out and other workers pick the jobs up
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        work(store, max(1, args.workers), args.follow, interval)
+    elif args.command == "coordinate":
+        store = open_ledger(args.ledger, f"coordinator-{node}")
+        coordinate(store, args.wait, interval)
+    else:
+        store = open_ledger(args.ledger, f"status-{node}")
+        print_status(store)
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""Long-running download daemon with a local HTTP/JSON API.
+
+Jobs are kept in a SQLite queue (app_data.daemon_queue_path), so they
+survive restarts, and are run by parallel_threads workers in one process
+that keeps its HTTP sessions, metadata cache, download archive and rate
+limiter warm between jobs. Playlists are expanded into one child job per
+video that is not in the download archive yet.
+
+    python daemon.py --port 8765
+
+    POST /jobs              {"url": "...", "playlist": false, "audio_only": true, "download_path": "..."}
+                            or {"urls": [...], ...}; omitted fields default to the config
+    GET  /jobs              ?status=queued&parent=<id>&after=<id>&limit=100
+    GET  /jobs/<id>         one job, with live progress while it runs and child counts for playlists
+    POST /jobs/<id>/cancel  cancel a job (also DELETE /jobs/<id>); running downloads stop at the next chunk
+    POST /jobs/<id>/retry   queue a failed or cancelled job (or a playlist's failed videos) again
+    GET  /status            queue counts, active downloads, throughput and cache stats
+    POST /reload            re-read config.json, e.g. after changing rate limits
+"""
+import os, re, sys, json, time, signal, argparse, threading, http.server
+from urllib.parse import urlsplit, parse_qs
+
+from YTDownload import (get_config, expand_playlist, download_with_retry, filename_index, get_rate_limiter, get_metadata_cache, get_run_recorder,
+                        reload_rate_limits, print_cache_stats, print_rate_stats)
+from job_store import JobStore, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+
+MAX_BODY = 1024 * 1024
+JOB_PATH = re.compile(r"^/jobs/(\d+)(?:/(cancel|retry))?$")
+
+
+class DownloadDaemon:
+    def __init__(self, store, workers, prefetch=True, poll_interval=5):
+        self.store = store
+        self.prefetch = prefetch
+        self.poll_interval = poll_interval
+        self.wakeup = threading.Condition()
+        self.stopping = False
+        self.lock = threading.Lock()
+        self.progress = {}
+        self.cancelled = set()
+        self.cancel_events = {}
+        self.started_at = time.time()
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, workers))]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.wakeup:
+            self.stopping = True
+            self.wakeup.notify_all()
+
+    def submit(self, request):
+        settings = get_config()["settings"]
+        urls = request["urls"] if "urls" in request else [request.get("url")]
+        # a string would otherwise be queued one character at a time
+        if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url.strip() for url in urls):
+            raise ValueError("Expected 'url' as a non-empty string or 'urls' as a list of non-empty strings")
+        # bool("false") is True, so only JSON booleans are accepted
+        for name in ("audio_only", "playlist"):
+            if request.get(name) is not None and not isinstance(request[name], bool):
+                raise ValueError(f"Expected '{name}' to be true or false")
+        download_path = request.get("download_path")
+        if download_path is not None and not isinstance(download_path, str):
+            raise ValueError("Expected 'download_path' to be a string")
+        audio_only = request.get("audio_only")
+        if audio_only is None:
+            audio_only = settings["audio_only"]
+        download_path = download_path or get_config()["app_data"]["download_path"]
+        jobs = []
+        for url in urls:
+            url = url.strip()
+            is_playlist = request.get("playlist")
+            if is_playlist is None:
+                is_playlist = "list=" in url and "v=" not in url
+            jobs.append(self.store.add(url, "playlist" if is_playlist else "video", audio_only, download_path))
+        with self.wakeup:
+            self.wakeup.notify(len(jobs))
+        return jobs
+
+    def cancel(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        running = [child["id"] for child in self.store.list(status=RUNNING, parent_id=job_id, limit=1000)]
+        if job["status"] == RUNNING:
+            running.append(job_id)
+        self._mark_cancelled(running)
+        self.store.cancel(job_id)
+        return self.view(self.store.get(job_id))
+
+    def _mark_cancelled(self, job_ids):
+        with self.lock:
+            self.cancelled.update(job_ids)
+            # wakes downloads that are waiting out a retry backoff
+            for job_id in job_ids:
+                if job_id in self.cancel_events:
+                    self.cancel_events[job_id].set()
+
+    def renew_leases(self):
+        lost = self.store.renew_leases()
+        if lost:
+            # another worker took these over after our lease ran out: stop at the next chunk instead of downloading twice
+            self._mark_cancelled(lost)
+        return lost
+
+    def retry(self, job_id):
+        if not self.store.retry(job_id):
+            return None
+        with self.wakeup:
+            self.wakeup.notify_all()
+        return self.view(self.store.get(job_id))
+
+    def view(self, job):
+        if job is None:
+            return None
+        with self.lock:
+            progress = self.progress.get(job["id"])
+            job = dict(job, progress=dict(progress) if progress else None, cancelling=job["id"] in self.cancelled)
+        if job["kind"] == "playlist":
+            job["videos"] = self.store.counts(parent_id=job["id"])
+        return job
+
+    def status(self):
+        with self.lock:
+            active = [dict(progress, id=job_id) for job_id, progress in self.progress.items()]
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "workers": len(self.threads),
+            "jobs": self.store.counts(),
+            "active": active,
+            "rate": get_rate_limiter().stats(),
+            "metadata_cache": get_metadata_cache().stats(),
+        }
+
+    def _claim(self):
+        with self.wakeup:
+            while not self.stopping:
+                job = self.store.claim()
+                if job is not None:
+                    return job
+                self.wakeup.wait(self.poll_interval)
+        return None
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            try:
+                self._run(job)
+            except Exception as e:
+                with self.lock:
+                    cancelled = job["id"] in self.cancelled
+                self.store.finish(job["id"], CANCELLED if cancelled else FAILED, None if cancelled else str(e))
+            finally:
+                with self.lock:
+                    self.progress.pop(job["id"], None)
+                    self.cancelled.discard(job["id"])
+                    self.cancel_events.pop(job["id"], None)
+
+    def _run(self, job):
+        if job["kind"] == "playlist":
+            playlist_name, playlist_folder, video_urls = expand_playlist(job["url"], job["audio_only"], job["download_path"], self.prefetch)
+            queued = self.store.expand(job["id"], playlist_name, video_urls, playlist_folder)
+            if queued is None:
+                # the lease ran out meanwhile; the worker that took the playlist over expands it
+                return
+            with self.lock:
+                cancelled = job["id"] in self.cancelled
+            if cancelled:
+                self.store.cancel(job["id"])
+                return
+            with self.wakeup:
+                self.wakeup.notify(queued)
+            return
+        job_id = job["id"]
+        if self.store.owner is not None:
+            # other nodes write into the same shared folders, so names they have taken since the last scan are picked up first
+            filename_index.rescan(job["download_path"])
+        cancel_event = threading.Event()
+        with self.lock:
+            self.progress[job_id] = {"title": None, "bytes_done": 0, "total": None, "bytes_per_second": 0, "started_at": time.time()}
+            self.cancel_events[job_id] = cancel_event
+            if job_id in self.cancelled:
+                cancel_event.set()
+
+        def on_progress(download_job, bytes_done, total):
+            with self.lock:
+                progress = self.progress[job_id]
+                elapsed = time.time() - progress["started_at"]
+                progress.update(title=download_job["title"], bytes_done=bytes_done, total=total,
+                                bytes_per_second=round(bytes_done / elapsed) if elapsed > 0 else 0)
+
+        # cancel() and lost leases set the event, which stops the download at the next chunk or during a retry backoff
+        download_with_retry(job["url"], job["audio_only"], job["download_path"], cancel_event=cancel_event, progress=on_progress)
+        with self.lock:
+            title = self.progress[job_id]["title"]
+        self.store.finish(job_id, DONE, title=title)
+
+
+class DaemonHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            raise ValueError("Request body too large")
+        if not length:
+            return {}
+        payload = json.loads(self.rfile.read(length))
+        if not isinstance(payload, dict):
+            raise ValueError("Expected a JSON object")
+        return payload
+
+    def _job_or_404(self, job):
+        if job is None:
+            self._send_json(404, {"error": "No such job"})
+        else:
+            self._send_json(200, job)
+
+    def do_GET(self):
+        daemon = self.server.download_daemon
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if parts.path == "/status":
+            self._send_json(200, daemon.status())
+            return
+        if parts.path == "/jobs":
+            try:
+                parent = int(query["parent"]) if "parent" in query else None
+                jobs = daemon.store.list(query.get("status"), parent, min(int(query.get("limit", 100)), 1000), int(query.get("after", 0)))
+            except ValueError:
+                self._send_json(400, {"error": "parent, limit and after must be integers"})
+                return
+            self._send_json(200, {"jobs": [daemon.view(job) for job in jobs]})
+            return
+        match = JOB_PATH.match(parts.path)
+        if match and not match[2]:
+            self._job_or_404(daemon.view(daemon.store.get(int(match[1]))))
+            return
+        self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        daemon = self.server.download_daemon
+        path = urlsplit(self.path).path
+        try:
+            request = self._read_json()
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        if path == "/jobs":
+            try:
+                jobs = daemon.submit(request)
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(201, {"jobs": [daemon.view(job) for job in jobs]})
+            return
+        if path == "/reload":
+            reload_rate_limits()
+            self._send_json(200, {"settings": get_config()["settings"]})
+            return
+        match = JOB_PATH.match(path)
+        if match and match[2] == "cancel":
+            self._job_or_404(daemon.cancel(int(match[1])))
+            return
+        if match and match[2] == "retry":
+            job = daemon.retry(int(match[1]))
+            if job is None:
+                self._send_json(409, {"error": "Only failed or cancelled jobs can be retried"})
+            else:
+                self._send_json(200, job)
+            return
+        self._send_json(404, {"error": "Not found"})
+
+    def do_DELETE(self):
+        match = JOB_PATH.match(urlsplit(self.path).path)
+        if match and not match[2]:
+            self._job_or_404(self.server.download_daemon.cancel(int(match[1])))
+            return
+        self._send_json(404, {"error": "Not found"})
+
+
+def main():
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    settings = get_config()["settings"]
+    parser = argparse.ArgumentParser(description="Download daemon with a local HTTP/JSON API.")
+    parser.add_argument("--host", default=settings.get("daemon_host", "127.0.0.1"), help="address to listen on")
+    parser.add_argument("--port", type=int, default=settings.get("daemon_port", 8765), help="port to listen on")
+    parser.add_argument("--queue", default=get_config()["app_data"].get("daemon_queue_path", "./daemon_queue.db"), help="job queue database")
+    parser.add_argument("--workers", type=int, default=settings["parallel_threads"], help="downloads run at once")
+    args = parser.parse_args()
+
+    store = JobStore(args.queue)
+    daemon = DownloadDaemon(store, args.workers)
+    server = http.server.ThreadingHTTPServer((args.host, args.port), DaemonHandler)
+    server.daemon_threads = True
+    server.download_daemon = daemon
+    # SIGTERM stops the server like Ctrl+C; downloads that were running are queued again on the next start
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    daemon.start()
+    counts = store.counts()
+    print(f"Listening on http://{args.host}:{server.server_address[1]} with {args.workers} workers, "
+          f"{counts.get(QUEUED, 0)} queued jobs in {args.queue}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        server.server_close()
+        print_cache_stats(get_metadata_cache().stats())
+        print_rate_stats(get_rate_limiter().stats())
+        recorder = get_run_recorder()
+        recorder.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import os, json, sqlite3, threading, time
+
+
+class DownloadArchive:
+    """Persistent index of finished downloads, keyed by video ID.
+
+    All rows are loaded into memory when the archive is opened, so lookups
+    are dictionary hits and never touch the network. Writes go through to
+    SQLite immediately, so an interrupted run keeps everything it finished.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            " video_id TEXT NOT NULL, kind TEXT NOT NULL, directory TEXT NOT NULL,"
+            " path TEXT NOT NULL, size INTEGER NOT NULL, format TEXT NOT NULL,"
+            " title TEXT, downloaded_at REAL NOT NULL,"
+            " PRIMARY KEY (video_id, kind, directory))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS playlist_snapshots ("
+            " playlist_id TEXT PRIMARY KEY, video_ids TEXT NOT NULL,"
+            " reported_length INTEGER, synced_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self.entries = {}
+        rows = self.connection.execute("SELECT video_id, kind, directory, path, size, format, title, downloaded_at FROM downloads")
+        for row in rows:
+            self._remember(*row)
+
+    def _remember(self, video_id, kind, directory, path, size, fmt, title, downloaded_at):
+        self.entries.setdefault((video_id, kind), {})[directory] = {
+            "video_id": video_id,
+            "kind": kind,
+            "directory": directory,
+            "path": path,
+            "size": size,
+            "format": fmt,
+            "title": title,
+            "downloaded_at": downloaded_at,
+        }
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(locations) for locations in self.entries.values())
+
+    def lookup(self, video_id, kind, directory):
+        """Returns the entry for video_id in directory if its file is still there."""
+        directory = os.path.abspath(directory)
+        with self.lock:
+            entry = self.entries.get((video_id, kind), {}).get(directory)
+        if entry is None:
+            return None
+        try:
+            if os.path.getsize(entry["path"]) == entry["size"]:
+                return entry
+        except OSError:
+            pass
+        self.forget(video_id, kind, directory)
+        return None
+
+    def find(self, video_id, kind):
+        """Returns every directory video_id has been downloaded into."""
+        with self.lock:
+            return list(self.entries.get((video_id, kind), {}).values())
+
+    def record(self, video_id, kind, path, fmt, title=None):
+        path = os.path.abspath(path)
+        directory = os.path.dirname(path)
+        size = os.path.getsize(path)
+        downloaded_at = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO downloads (video_id, kind, directory, path, size, format, title, downloaded_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_id, kind, directory, path, size, fmt, title, downloaded_at),
+            )
+            self.connection.commit()
+            self._remember(video_id, kind, directory, path, size, fmt, title, downloaded_at)
+
+    def forget(self, video_id, kind, directory):
+        directory = os.path.abspath(directory)
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM downloads WHERE video_id = ? AND kind = ? AND directory = ?",
+                (video_id, kind, directory),
+            )
+            self.connection.commit()
+            self.entries.get((video_id, kind), {}).pop(directory, None)
+
+    def load_snapshot(self, playlist_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT video_ids, reported_length, synced_at FROM playlist_snapshots WHERE playlist_id = ?",
+                (playlist_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"video_ids": json.loads(row[0]), "reported_length": row[1], "synced_at": row[2]}
+
+    def save_snapshot(self, playlist_id, video_ids, reported_length=None):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO playlist_snapshots (playlist_id, video_ids, reported_length, synced_at)"
+                " VALUES (?, ?, ?, ?)",
+                (playlist_id, json.dumps(list(video_ids)), reported_length, time.time()),
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
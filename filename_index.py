@@ -0,0 +1,144 @@
+import os, sys, threading
+
+
+def name_key(name):
+    # Windows and macOS file systems are case-insensitive by default
+    return name.casefold() if sys.platform in ("win32", "darwin") else name
+
+
+def publish_file(source, target):
+    """Moves a finished file to target without ever replacing an existing file.
+
+    Raises FileExistsError when target exists, including when another
+    process or host created it a moment ago: a hardlink fails instead of
+    overwriting, and where the file system has no hardlinks (FAT/exFAT,
+    some SMB shares) the name is claimed with an exclusive create before
+    the file is renamed over the empty placeholder.
+    """
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        raise
+    except OSError:
+        os.close(os.open(target, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        os.replace(source, target)
+        return
+    os.remove(source)
+
+
+class DirectoryIndex:
+    """Names in one download directory: what was on disk when it was first
+    scanned, plus what this process has reserved or created since."""
+
+    def __init__(self, path):
+        self.path = path
+        self.names = set()
+        self.reserved = set()
+        self.next_suffix = {}
+        self.scan()
+
+    def scan(self):
+        """Reads the names on disk again; reservations and suffix counters are kept."""
+        names = set()
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    names.add(name_key(entry.name))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        self.names = names
+
+    def exists(self, name):
+        return name_key(name) in self.names
+
+    def taken(self, name):
+        key = name_key(name)
+        return key in self.names or key in self.reserved
+
+    def unique_name(self, filename):
+        if not self.taken(filename):
+            return filename
+        base_name, extension = os.path.splitext(filename)
+        key = name_key(filename)
+        # resume from the last suffix handed out, so a folder full of "Title (n)" is not walked from 1 every time
+        counter = self.next_suffix.get(key, 1)
+        while self.taken(f"{base_name} ({counter}){extension}"):
+            counter += 1
+        self.next_suffix[key] = counter
+        return f"{base_name} ({counter}){extension}"
+
+
+class FilenameIndex:
+    """In-memory listings of the download directories, used to pick file names.
+
+    Each directory is read with a single os.scandir the first time a name
+    is needed in it; after that, name checks are set lookups and never stat
+    the file system. Names handed to a download are reserved until the job
+    is released, and the index is updated with whether the file was
+    created. ``lock`` is reentrant, so a caller can hold it across
+    unique_name(), exists() and reserve() to claim a name atomically.
+    Files created in the directory by other programs during a run are not
+    seen.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.directories = {}
+
+    def directory(self, path):
+        key = os.path.normcase(os.path.abspath(path))
+        with self.lock:
+            index = self.directories.get(key)
+            if index is None:
+                index = self.directories[key] = DirectoryIndex(path)
+            return index
+
+    def unique_name(self, path, filename):
+        with self.lock:
+            return self.directory(path).unique_name(filename)
+
+    def exists(self, file_path):
+        path, name = os.path.split(file_path)
+        with self.lock:
+            return self.directory(path).exists(name)
+
+    def taken(self, file_path):
+        path, name = os.path.split(file_path)
+        with self.lock:
+            return self.directory(path).taken(name)
+
+    def reserve(self, *file_paths):
+        with self.lock:
+            for file_path in file_paths:
+                path, name = os.path.split(file_path)
+                self.directory(path).reserved.add(name_key(name))
+
+    def release(self, *file_paths):
+        """Drops the reservations and records whether each file now exists."""
+        created = [os.path.exists(file_path) for file_path in file_paths]
+        with self.lock:
+            for file_path, exists in zip(file_paths, created):
+                path, name = os.path.split(file_path)
+                index = self.directory(path)
+                key = name_key(name)
+                index.reserved.discard(key)
+                if exists:
+                    index.names.add(key)
+                else:
+                    index.names.discard(key)
+
+    def rescan(self, path=None):
+        """Reads path (or every known directory) from disk again.
+
+        Names reserved by downloads that are still running stay reserved,
+        so a rescan in the middle of a run cannot hand them out twice.
+        """
+        with self.lock:
+            if path is None:
+                indexes = list(self.directories.values())
+            else:
+                # a directory that is not indexed yet is scanned when first used
+                index = self.directories.get(os.path.normcase(os.path.abspath(path)))
+                indexes = [index] if index is not None else []
+            for index in indexes:
+                index.scan()
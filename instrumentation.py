@@ -0,0 +1,213 @@
+import io, os, sys, json, time, math, threading
+from collections import Counter
+
+
+def percentile(sorted_values, fraction):
+    # nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+class RunRecorder:
+    """Per-item, per-stage timings for one run, appended to a JSONL report.
+
+    Every stage of every item becomes one ``"type": "stage"`` record with
+    its wall time, bytes, throughput and retry count; close() appends a
+    ``"type": "summary"`` record with per-stage percentiles.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.run_id = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.lock = threading.Lock()
+        self.records = []
+        self.file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, "a", encoding="utf-8")
+
+    def _write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def record(self, stage, url, seconds, attempt=0, byte_count=None, error=None):
+        record = {
+            "type": "stage",
+            "run_id": self.run_id,
+            "time": round(time.time(), 3),
+            "url": url,
+            "stage": stage,
+            "seconds": round(seconds, 4),
+            "bytes": byte_count,
+            "bytes_per_second": round(byte_count / seconds) if byte_count and seconds > 0 else None,
+            "retries": attempt,
+            "ok": error is None,
+            "error": str(error) if error is not None else None,
+        }
+        with self.lock:
+            self.records.append(record)
+            self._write(record)
+
+    def record_job(self, stage, url, attempt, job, seconds, error=None):
+        """Records a pipeline stage, plus the metadata/naming split that resolve_video stores in job["timings"]."""
+        if stage == "resolve" and job is not None:
+            for sub_stage, sub_seconds in job.get("timings", {}).items():
+                self.record(sub_stage, url, sub_seconds, attempt)
+        byte_count = job.get("bytes") if stage == "download" and job is not None else None
+        self.record(stage, url, seconds, attempt, byte_count, error)
+
+    def measure(self, stage, url, attempt, job, func, *args):
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except BaseException as e:
+            self.record_job(stage, url, attempt, job, time.perf_counter() - start, e)
+            raise
+        self.record_job(stage, url, attempt, result if job is None else job, time.perf_counter() - start)
+        return result
+
+    def item_seconds(self, stages):
+        """Seconds each URL spent in the given stages, counting successful runs only."""
+        seconds = {}
+        with self.lock:
+            for record in self.records:
+                if record["ok"] and record["stage"] in stages:
+                    seconds[record["url"]] = seconds.get(record["url"], 0.0) + record["seconds"]
+        return seconds
+
+    def summary(self):
+        with self.lock:
+            records = list(self.records)
+        stages = {}
+        for record in records:
+            stages.setdefault(record["stage"], []).append(record)
+        summary = {}
+        for stage, stage_records in stages.items():
+            seconds = sorted(record["seconds"] for record in stage_records)
+            total_bytes = sum(record["bytes"] or 0 for record in stage_records)
+            total_seconds = sum(seconds)
+            summary[stage] = {
+                "count": len(stage_records),
+                "failed": sum(1 for record in stage_records if not record["ok"]),
+                "retries": sum(1 for record in stage_records if record["retries"]),
+                "total_seconds": round(total_seconds, 3),
+                "p50_seconds": percentile(seconds, 0.5),
+                "p90_seconds": percentile(seconds, 0.9),
+                "p99_seconds": percentile(seconds, 0.99),
+                "max_seconds": seconds[-1],
+                "bytes": total_bytes,
+                "bytes_per_second": round(total_bytes / total_seconds) if total_bytes and total_seconds else None,
+            }
+        return summary
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            file, self.file = self.file, None
+        if self.records:
+            file.write(json.dumps({"type": "summary", "run_id": self.run_id, "time": round(time.time(), 3),
+                                   "stages": self.summary()}) + "\n")
+        file.close()
+
+
+class Profiler:
+    """Optional profiler for a run: ``cprofile`` or ``sampling``.
+
+    cProfile only sees the thread it is enabled on, so in ``cprofile`` mode
+    each stage function is wrapped with wrap() and profiled in its own
+    thread; the per-thread stats are merged on stop(). Python 3.12+ allows
+    a single active cProfile, so overlapping stage calls there run
+    unprofiled and are counted as skipped. ``sampling`` mode instead reads
+    the stacks of every thread each ``interval`` seconds and writes them
+    in folded-stack format for flame graph tools.
+    """
+
+    def __init__(self, mode, interval=0.005):
+        if mode not in ("cprofile", "sampling"):
+            raise ValueError(f"Unknown profile mode {mode!r}, expected 'cprofile' or 'sampling'")
+        self.mode = mode
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles = []
+        self.skipped = 0
+        self.samples = Counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.mode == "sampling" and self.thread is None:
+            self.thread = threading.Thread(target=self._sample, daemon=True)
+            self.thread.start()
+
+    def wrap(self, func):
+        if self.mode != "cprofile":
+            return func
+
+        def profiled(*args, **kwargs):
+            profile = getattr(self.local, "profile", None)
+            if profile is None:
+                import cProfile
+                profile = self.local.profile = cProfile.Profile()
+                with self.lock:
+                    self.profiles.append(profile)
+            try:
+                profile.enable()
+            except ValueError:
+                with self.lock:
+                    self.skipped += 1
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+        return profiled
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self, path, top=15):
+        """Writes the profile to path (.prof or .folded is appended) and returns (file, text summary)."""
+        if self.mode == "sampling":
+            self.stop_event.set()
+            if self.thread is not None:
+                self.thread.join()
+            path += ".folded"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in self.samples.items():
+                    f.write(f"{stack} {count}\n")
+            leaves = Counter()
+            for stack, count in self.samples.items():
+                leaves[stack.rsplit(";", 1)[-1]] += count
+            total = sum(leaves.values()) or 1
+            lines = [f"{count:>7} {count / total:6.1%}  {leaf}" for leaf, count in leaves.most_common(top)]
+            return path, "\n".join([f"{total} samples, top frames by self time:"] + lines)
+        path += ".prof"
+        with self.lock:
+            profiles = [profile for profile in self.profiles if profile.getstats()]
+        if not profiles:
+            return None, "No stage calls were profiled"
+        import pstats
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        output = io.StringIO()
+        stats.stream = output
+        stats.sort_stats("cumulative").print_stats(top)
+        if self.skipped:
+            output.write(f"{self.skipped} overlapping stage calls were not profiled\n")
+        return path, output.getvalue()
@@ -0,0 +1,268 @@
+import os, sqlite3, threading, time
+
+QUEUED = "queued"
+RUNNING = "running"
+WAITING = "waiting"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+COLUMNS = ("id", "url", "kind", "audio_only", "download_path", "parent_id", "status", "title", "error",
+           "attempts", "created_at", "started_at", "finished_at", "lease_owner", "lease_expires_at")
+
+
+class JobStore:
+    """Persistent queue of download jobs for the daemon, kept in SQLite.
+
+    Every state change is committed immediately, so a restart picks up
+    where the last process stopped: jobs that were running are put back in
+    the queue when the store is opened. Playlist jobs wait in ``waiting``
+    once their videos have been queued as child jobs, and finish when the
+    last child does.
+
+    A store opened with an ``owner`` is a ledger shared by several
+    processes or hosts instead. Each claim leases the job to the owner,
+    which keeps the lease alive with renew_leases(); a job whose lease runs
+    out, because its worker died or lost the shared storage, is queued
+    again by the next claim rather than when a store is opened, and failed
+    once it has been claimed max_attempts times.
+    """
+
+    def __init__(self, path, owner=None, lease_seconds=60, max_attempts=3):
+        self.path = path
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.leases = set()
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # writes take the lock up front, so two processes claiming at once wait for each other instead of deadlocking
+        self.connection = sqlite3.connect(path, timeout=30 if owner else 5, isolation_level="IMMEDIATE", check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # WAL keeps its index in shared memory, which only works between processes on one host
+        self.connection.execute("PRAGMA journal_mode=DELETE" if owner else "PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, kind TEXT NOT NULL,"
+            " audio_only INTEGER NOT NULL, download_path TEXT, parent_id INTEGER,"
+            " status TEXT NOT NULL, title TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL, lease_owner TEXT, lease_expires_at REAL)"
+        )
+        columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("lease_owner", "TEXT"), ("lease_expires_at", "REAL")):
+            if column not in columns:
+                # queues written before leases existed
+                self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_parent ON jobs (parent_id)")
+        if owner is None:
+            with self.connection:
+                self.connection.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?", (QUEUED, RUNNING))
+
+    def _job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["audio_only"] = bool(job["audio_only"])
+        return job
+
+    def _insert(self, url, kind, audio_only, download_path, parent_id=None):
+        cursor = self.connection.execute(
+            "INSERT INTO jobs (url, kind, audio_only, download_path, parent_id, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, kind, int(audio_only), download_path, parent_id, QUEUED, time.time()),
+        )
+        return cursor.lastrowid
+
+    def add(self, url, kind, audio_only, download_path, unique=False):
+        """Queues a job; with unique, returns the unfinished job for the same URL and folder instead of adding another."""
+        with self.lock, self.connection:
+            row = None
+            if unique:
+                row = self.connection.execute(
+                    "SELECT id FROM jobs WHERE url = ? AND kind = ? AND download_path IS ? AND parent_id IS NULL"
+                    " AND status NOT IN (?, ?, ?) LIMIT 1", (url, kind, download_path, *FINISHED),
+                ).fetchone()
+            job_id = row["id"] if row is not None else self._insert(url, kind, audio_only, download_path)
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self.lock:
+            return self._job(self.connection.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, status=None, parent_id=None, limit=100, after=0):
+        query = f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id > ?"
+        parameters = [after]
+        if status:
+            query += " AND status = ?"
+            parameters.append(status)
+        if parent_id is not None:
+            query += " AND parent_id = ?"
+            parameters.append(parent_id)
+        query += " ORDER BY id LIMIT ?"
+        parameters.append(limit)
+        with self.lock:
+            return [self._job(row) for row in self.connection.execute(query, parameters)]
+
+    def counts(self, parent_id=None):
+        query = "SELECT status, COUNT(*) FROM jobs"
+        parameters = ()
+        if parent_id is not None:
+            query += " WHERE parent_id = ?"
+            parameters = (parent_id,)
+        with self.lock:
+            return dict(self.connection.execute(query + " GROUP BY status", parameters).fetchall())
+
+    def claim(self):
+        """Marks the oldest queued job as running and returns it, or None if the queue is empty.
+
+        In a shared ledger, expired leases are reclaimed first and the job is
+        leased to this store's owner.
+        """
+        with self.lock, self.connection:
+            now = time.time()
+            if self.owner is not None:
+                self._reclaim_expired(now)
+            rows = self.connection.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?"
+                f" WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1) RETURNING {', '.join(COLUMNS)}",
+                (RUNNING, now, self.owner, now + self.lease_seconds if self.owner is not None else None, QUEUED),
+            ).fetchall()
+            if not rows:
+                return None
+            row = rows[0]
+            if self.owner is not None:
+                self.leases.add(row["id"])
+        return self._job(row)
+
+    def reclaim_expired(self):
+        """Queues jobs whose lease ran out again (or fails them after max_attempts claims). Returns how many there were."""
+        with self.lock, self.connection:
+            return self._reclaim_expired(time.time())
+
+    def _reclaim_expired(self, now):
+        failed = self.connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL"
+            " WHERE status = ? AND lease_expires_at < ? AND attempts >= ? RETURNING parent_id",
+            (FAILED, f"Lease expired {self.max_attempts} times; its worker stopped responding", now, RUNNING, now, self.max_attempts),
+        ).fetchall()
+        for row in failed:
+            if row["parent_id"] is not None:
+                self._settle_parent(row["parent_id"])
+        requeued = self.connection.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, lease_owner = NULL, lease_expires_at = NULL"
+            " WHERE status = ? AND lease_expires_at < ?", (QUEUED, RUNNING, now),
+        ).rowcount
+        return len(failed) + requeued
+
+    def renew_leases(self):
+        """Extends every lease this owner holds. Returns the IDs of jobs it claimed whose lease was lost meanwhile."""
+        with self.lock, self.connection:
+            held = {row["id"] for row in self.connection.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE status = ? AND lease_owner = ? RETURNING id",
+                (time.time() + self.lease_seconds, RUNNING, self.owner),
+            ).fetchall()}
+            lost = self.leases - held
+            self.leases &= held
+        return lost
+
+    def expand(self, job_id, title, urls, download_path):
+        """Queues the videos of a playlist job as child jobs, in the same transaction that moves it to waiting.
+
+        Videos already queued or running for the same folder are left out, so
+        a playlist submitted twice is not downloaded twice at once. Returns
+        the number of videos queued, or None if the job is no longer running
+        under this store's owner.
+        """
+        with self.lock, self.connection:
+            parent = self.connection.execute("SELECT audio_only FROM jobs WHERE id = ? AND status = ? AND lease_owner IS ?",
+                                             (job_id, RUNNING, self.owner)).fetchone()
+            if parent is None:
+                return None
+            in_flight = {row["url"] for row in self.connection.execute(
+                "SELECT url FROM jobs WHERE kind = ? AND download_path IS ? AND audio_only = ? AND status IN (?, ?)",
+                ("video", download_path, parent["audio_only"], QUEUED, RUNNING),
+            )}
+            urls = [url for url in dict.fromkeys(urls) if url not in in_flight]
+            for url in urls:
+                self._insert(url, "video", parent["audio_only"], download_path, job_id)
+            self.connection.execute("UPDATE jobs SET status = ?, title = ?, lease_expires_at = NULL WHERE id = ?", (WAITING, title, job_id))
+            self._settle_parent(job_id)
+            self.leases.discard(job_id)
+        return len(urls)
+
+    def finish(self, job_id, status, error=None, title=None):
+        """Records how a running job ended. Returns False, changing nothing, if another worker has taken it over."""
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, title = COALESCE(?, title), finished_at = ?, lease_expires_at = NULL"
+                " WHERE id = ? AND status = ? AND lease_owner IS ?",
+                (status, error, title, time.time(), job_id, RUNNING, self.owner),
+            )
+            self.leases.discard(job_id)
+            if not cursor.rowcount:
+                return False
+            row = self.connection.execute("SELECT parent_id FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row["parent_id"] is not None:
+                self._settle_parent(row["parent_id"])
+        return True
+
+    def workers(self):
+        """Video totals per worker that claimed them: counts by status, plus when its first started and last finished."""
+        workers = {}
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT lease_owner, status, COUNT(*), MIN(started_at), MAX(finished_at) FROM jobs"
+                " WHERE kind = ? AND lease_owner IS NOT NULL GROUP BY lease_owner, status", ("video",),
+            ).fetchall()
+        for owner, status, count, started_at, finished_at in rows:
+            worker = workers.setdefault(owner, {"started_at": started_at, "finished_at": finished_at})
+            worker[status] = count
+            worker["started_at"] = min(filter(None, (worker["started_at"], started_at)), default=None)
+            worker["finished_at"] = max(filter(None, (worker["finished_at"], finished_at)), default=None)
+        return workers
+
+    def _settle_parent(self, parent_id):
+        counts = dict(self.connection.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE parent_id = ? GROUP BY status", (parent_id,)
+        ).fetchall())
+        if any(status not in FINISHED for status in counts):
+            return
+        failed = counts.get(FAILED, 0)
+        self.connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (FAILED if failed else DONE, f"{failed} of {sum(counts.values())} videos failed" if failed else None,
+             time.time(), parent_id, WAITING),
+        )
+
+    def cancel(self, job_id):
+        """Cancels a job that has not started, and the queued videos of a playlist. Returns the job's status afterwards."""
+        with self.lock, self.connection:
+            now = time.time()
+            self.connection.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE parent_id = ? AND status = ?",
+                                    (CANCELLED, now, job_id, QUEUED))
+            self.connection.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)",
+                                    (CANCELLED, now, job_id, QUEUED, WAITING))
+            self._settle_parent(job_id)
+            row = self.connection.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row is not None else None
+
+    def retry(self, job_id):
+        """Puts a failed or cancelled job back in the queue; for an expanded playlist, its failed and cancelled videos."""
+        with self.lock, self.connection:
+            requeued = self.connection.execute(
+                "UPDATE jobs SET status = ?, error = NULL, started_at = NULL, finished_at = NULL WHERE parent_id = ? AND status IN (?, ?)",
+                (QUEUED, job_id, FAILED, CANCELLED),
+            ).rowcount
+            has_children = self.connection.execute("SELECT 1 FROM jobs WHERE parent_id = ? LIMIT 1", (job_id,)).fetchone()
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = ?, error = NULL, started_at = NULL, finished_at = NULL WHERE id = ? AND status IN (?, ?)",
+                (WAITING if has_children else QUEUED, job_id, FAILED, CANCELLED),
+            )
+            self._settle_parent(job_id)
+        return cursor.rowcount > 0 or requeued > 0
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,176 @@
+import time, json, sqlite3, threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+# stream URLs are re-resolved this many seconds before they expire
+EXPIRY_MARGIN = 600
+
+
+def url_expiry(url):
+    try:
+        return int(parse_qs(urlsplit(url).query)["expire"][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def stream_record(stream):
+    resolution = getattr(stream, "resolution", None)
+    return {
+        "itag": stream.itag,
+        "url": stream.url,
+        "mime_type": stream.mime_type,
+        "subtype": stream.subtype,
+        "audio_codec": stream.audio_codec,
+        "video_codec": stream.video_codec,
+        "abr": int(stream.abr.rstrip("kbps")) if getattr(stream, "abr", None) else None,
+        "resolution": int(resolution.rstrip("p")) if resolution else None,
+        "fps": getattr(stream, "fps", None),
+        "bitrate": getattr(stream, "bitrate", None),
+        # contentLength from the player response; reading .filesize would send a HEAD request per stream
+        "filesize": getattr(stream, "_filesize", None) or None,
+        "is_progressive": stream.is_progressive,
+        "includes_audio_track": stream.includes_audio_track,
+        "includes_video_track": stream.includes_video_track,
+        "expires_at": url_expiry(stream.url),
+    }
+
+
+def manifest_from_youtube(youtube, video_id=None):
+    """Flattens a YouTube object into a JSON-serialisable manifest."""
+    streams = [stream_record(stream) for stream in youtube.streams]
+    expiries = [stream["expires_at"] for stream in streams if stream["expires_at"]]
+    return {
+        "video_id": video_id or youtube.video_id,
+        "title": youtube.title,
+        "streams": streams,
+        "resolved_at": time.time(),
+        "expires_at": min(expiries) if expiries else None,
+    }
+
+
+async def manifest_from_async_youtube(youtube, video_id=None):
+    """manifest_from_youtube for pytubefix.AsyncYouTube, whose title and streams are coroutines."""
+    streams = [stream_record(stream) for stream in await youtube.streams()]
+    expiries = [stream["expires_at"] for stream in streams if stream["expires_at"]]
+    return {
+        "video_id": video_id or youtube.video_id,
+        "title": await youtube.title(),
+        "streams": streams,
+        "resolved_at": time.time(),
+        "expires_at": min(expiries) if expiries else None,
+    }
+
+
+def manifest_expired(manifest, margin=EXPIRY_MARGIN):
+    expires_at = manifest.get("expires_at")
+    return expires_at is not None and expires_at - margin <= time.time()
+
+
+class MetadataCache:
+    """Two-level TTL cache for video manifests and playlist listings.
+
+    The first level is an in-process LRU capped at ``max_entries``. The
+    optional second level is a SQLite file shared across runs, capped at
+    ``max_disk_entries`` and trimmed oldest-first. Values must be JSON
+    serialisable.
+    """
+
+    def __init__(self, ttl=21600, max_entries=4096, path=None, max_disk_entries=None):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_disk_entries = max_disk_entries or self.max_entries * 10
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "evictions": 0, "stores": 0}
+        self.connection = None
+        if path:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self.connection.execute("DELETE FROM metadata WHERE stored_at < ?", (time.time() - self.ttl,))
+            self.connection.commit()
+
+    def _count(self, counter):
+        self.counters[counter] += 1
+
+    def _remember(self, key, stored_at, value):
+        self.memory[key] = (stored_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self._count("evictions")
+
+    def get(self, key, is_stale=None):
+        """Returns the cached value, or None on a miss, TTL expiry or is_stale(value)."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            level = "memory_hits"
+            if entry is None and self.connection is not None:
+                row = self.connection.execute("SELECT stored_at, value FROM metadata WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    level = "disk_hits"
+            if entry is None:
+                self._count("misses")
+                return None
+            stored_at, value = entry
+            if now - stored_at > self.ttl or (is_stale is not None and is_stale(value)):
+                self._count("expired")
+                self._invalidate(key)
+                return None
+            self._count(level)
+            self._remember(key, stored_at, value)
+            return value
+
+    def put(self, key, value):
+        stored_at = time.time()
+        with self.lock:
+            self._count("stores")
+            self._remember(key, stored_at, value)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO metadata (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), stored_at),
+                )
+                overflow = self.connection.execute("SELECT COUNT(*) FROM metadata").fetchone()[0] - self.max_disk_entries
+                if overflow > 0:
+                    self.connection.execute(
+                        "DELETE FROM metadata WHERE key IN (SELECT key FROM metadata ORDER BY stored_at LIMIT ?)",
+                        (overflow,),
+                    )
+                    self.counters["evictions"] += overflow
+                self.connection.commit()
+
+    def _invalidate(self, key):
+        self.memory.pop(key, None)
+        if self.connection is not None:
+            self.connection.execute("DELETE FROM metadata WHERE key = ?", (key,))
+            self.connection.commit()
+
+    def invalidate(self, key):
+        with self.lock:
+            self._invalidate(key)
+
+    def get_or_load(self, key, loader, is_stale=None):
+        value = self.get(key, is_stale)
+        if value is None:
+            value = loader()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"] + stats["expired"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
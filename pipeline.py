@@ -0,0 +1,296 @@
+import os, time, heapq, queue, threading, itertools
+
+STAGES = ("resolve", "download", "transcode")
+
+
+class RetryQueue:
+    """Unbounded queue whose items become available at a scheduled time.
+
+    New items are ready immediately; retried items are scheduled after
+    their backoff delay, so they go behind everything that is already
+    waiting. pause() holds back every item, which is how a throttling
+    response slows the whole stage down instead of one worker.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.paused_until = 0.0
+        self.closed = False
+
+    def put(self, item, delay=0.0):
+        with self.condition:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), item))
+            self.condition.notify()
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self):
+        """Blocks until an item is ready; returns None once the queue is closed."""
+        with self.condition:
+            while True:
+                if self.closed:
+                    return None
+                now = time.monotonic()
+                ready_at = max(self.heap[0][0], self.paused_until) if self.heap else None
+                if ready_at is not None and ready_at <= now:
+                    return heapq.heappop(self.heap)[2]
+                self.condition.wait(None if ready_at is None else ready_at - now)
+
+    def qsize(self):
+        with self.condition:
+            return len(self.heap)
+
+
+class StageStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds, ok=True):
+        with self.lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.busy_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self):
+        with self.lock:
+            runs = self.completed + self.failed
+            return {
+                "completed": self.completed,
+                "failed": self.failed,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "avg_seconds": round(self.busy_seconds / runs, 3) if runs else 0.0,
+                "max_seconds": round(self.max_seconds, 3),
+            }
+
+
+class QueueStats:
+    """Size of a stage's input queue, sampled while the pipeline runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.total = 0
+        self.max_size = 0
+
+    def sample(self, size):
+        with self.lock:
+            self.samples += 1
+            self.total += size
+            self.max_size = max(self.max_size, size)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "max": self.max_size,
+                "avg": round(self.total / self.samples, 2) if self.samples else 0.0,
+            }
+
+
+class DownloadPipeline:
+    """Runs items through resolve -> download -> transcode stages.
+
+    resolve(url) returns a job dict, or None when there is nothing to do.
+    download(job) fetches the stream and may set job["transcode"] to an
+    argument tuple for transcode(), which runs in a process pool.
+    finish(job) runs in this process after an item's last stage, and an
+    error from it is handled like a failure of that stage. Each
+    stage has its own workers and the stages are joined by bounded queues,
+    so a slow stage applies back-pressure instead of piling up work.
+    on_stage(stage, url, attempt, job, seconds, error=None) is called after
+    every stage run, for per-item instrumentation. The size of each
+    stage's input queue is sampled every sample_interval seconds.
+    """
+
+    def __init__(self, resolve, download, transcode, resolve_workers=2, download_workers=4,
+                 transcode_workers=None, queue_depth=4, retry_policy=None, finish=None, cleanup=None, on_retry=None, on_stage=None,
+                 sample_interval=0.05):
+        self.resolve = resolve
+        self.download = download
+        self.transcode = transcode
+        self.resolve_workers = max(1, resolve_workers)
+        self.download_workers = max(1, download_workers)
+        self.transcode_workers = max(1, transcode_workers or os.cpu_count() or 1)
+        self.queue_depth = max(1, queue_depth)
+        self.retry_policy = retry_policy
+        self.finish = finish
+        self.cleanup = cleanup
+        self.on_retry = on_retry
+        self.on_stage = on_stage
+        self.stage_stats = {stage: StageStats() for stage in STAGES}
+        self.queue_stats = {stage: QueueStats() for stage in STAGES}
+        self.sample_interval = sample_interval
+        self.retry_counts = {}
+        self.retry_lock = threading.Lock()
+        self.resolve_queue = RetryQueue()
+        self.download_queue = queue.Queue(maxsize=self.queue_depth)
+        self.transcode_queue = queue.Queue(maxsize=self.queue_depth)
+        self.results = queue.Queue()
+        self.started_at = None
+
+    def stats(self):
+        return {
+            "elapsed_seconds": round(time.perf_counter() - self.started_at, 3) if self.started_at else 0.0,
+            "workers": {
+                "resolve": self.resolve_workers,
+                "download": self.download_workers,
+                "transcode": self.transcode_workers,
+            },
+            "queue_depth": {stage: stats.snapshot() for stage, stats in self.queue_stats.items()},
+            "stages": {stage: stats.snapshot() for stage, stats in self.stage_stats.items()},
+            "retries": dict(self.retry_counts),
+        }
+
+    def _sample_queues(self, stopped):
+        queues = {"resolve": self.resolve_queue, "download": self.download_queue, "transcode": self.transcode_queue}
+        while True:
+            for stage, stage_queue in queues.items():
+                self.queue_stats[stage].sample(stage_queue.qsize())
+            if stopped.wait(self.sample_interval):
+                return
+
+    def _timed(self, stage, url, attempt, job, func, *args):
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except BaseException as e:
+            seconds = time.perf_counter() - start
+            self.stage_stats[stage].record(seconds, ok=False)
+            if self.on_stage:
+                self.on_stage(stage, url, attempt, job, seconds, e)
+            raise
+        seconds = time.perf_counter() - start
+        self.stage_stats[stage].record(seconds)
+        if self.on_stage:
+            self.on_stage(stage, url, attempt, result if job is None else job, seconds)
+        return result
+
+    def _complete(self, url, attempt, job):
+        if self.finish:
+            try:
+                self.finish(job)
+            except Exception as e:
+                self._fail(url, attempt, job, e)
+                return
+        self._finish(url, job)
+
+    def _finish(self, url, job, error=None):
+        if job is not None and self.cleanup:
+            self.cleanup(job)
+        self.results.put((url, job, error))
+
+    def _fail(self, url, attempt, job, error):
+        policy = self.retry_policy
+        kind = policy.classify(error) if policy else None
+        if policy is None or not policy.should_retry(kind, attempt):
+            self._finish(url, job, str(error))
+            return
+        if job is not None and self.cleanup:
+            self.cleanup(job)
+        delay = policy.delay(kind, attempt)
+        with self.retry_lock:
+            self.retry_counts[kind] = self.retry_counts.get(kind, 0) + 1
+        if kind == "throttled":
+            self.resolve_queue.pause(delay)
+        if self.on_retry:
+            self.on_retry(url, attempt + 1, policy.max_attempts, error, kind, delay)
+        self.resolve_queue.put((url, attempt + 1), delay)
+
+    def _resolve_worker(self):
+        while True:
+            item = self.resolve_queue.get()
+            if item is None:
+                return
+            url, attempt = item
+            try:
+                job = self._timed("resolve", url, attempt, None, self.resolve, url)
+            except Exception as e:
+                self._fail(url, attempt, None, e)
+                continue
+            if job is None:
+                self._finish(url, None)
+            else:
+                self.download_queue.put((url, attempt, job))
+
+    def _download_worker(self):
+        while True:
+            item = self.download_queue.get()
+            if item is None:
+                return
+            url, attempt, job = item
+            try:
+                self._timed("download", url, attempt, job, self.download, job)
+            except Exception as e:
+                self._fail(url, attempt, job, e)
+                continue
+            if job.get("transcode"):
+                self.transcode_queue.put((url, attempt, job))
+            else:
+                self._complete(url, attempt, job)
+
+    def _transcode_worker(self, pool):
+        while True:
+            item = self.transcode_queue.get()
+            if item is None:
+                return
+            url, attempt, job = item
+            try:
+                self._timed("transcode", url, attempt, job, lambda: pool.submit(self.transcode, *job["transcode"]).result())
+            except Exception as e:
+                self._fail(url, attempt, job, e)
+                continue
+            self._complete(url, attempt, job)
+
+    def run(self, urls):
+        """Yields (url, job, error) as each item leaves the pipeline."""
+        urls = list(urls)
+        self.started_at = time.perf_counter()
+        if not urls:
+            return
+        for url in urls:
+            self.resolve_queue.put((url, 0))
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=self.transcode_workers) as pool:
+            groups = [
+                (self.resolve_queue, [threading.Thread(target=self._resolve_worker, daemon=True) for _ in range(self.resolve_workers)]),
+                (self.download_queue, [threading.Thread(target=self._download_worker, daemon=True) for _ in range(self.download_workers)]),
+                (self.transcode_queue, [threading.Thread(target=self._transcode_worker, args=(pool,), daemon=True) for _ in range(self.transcode_workers)]),
+            ]
+            for _, threads in groups:
+                for thread in threads:
+                    thread.start()
+            # queue sizes are only meaningful while items flow; after the run every queue is empty
+            sampling_stopped = threading.Event()
+            threading.Thread(target=self._sample_queues, args=(sampling_stopped,), daemon=True).start()
+            pending = len(urls)
+            try:
+                while pending:
+                    yield self.results.get()
+                    pending -= 1
+            finally:
+                sampling_stopped.set()
+                self.resolve_queue.close()
+                if pending:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                else:
+                    for stage_queue, threads in groups:
+                        if stage_queue is not self.resolve_queue:
+                            for _ in threads:
+                                stage_queue.put(None)
+                        for thread in threads:
+                            thread.join()
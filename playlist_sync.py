@@ -0,0 +1,37 @@
+def watch_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def reported_length(playlist):
+    try:
+        return playlist.length
+    except Exception:
+        return None
+
+
+def sync_playlist(playlist, snapshot=None, newest_first=False):
+    """Diffs a playlist against its last snapshot, paging as little as possible.
+
+    Playlists in YouTube's default order (oldest first) are always paged
+    in full: an unchanged video count does not mean unchanged contents,
+    since one video can be removed and another added. For newest-first
+    playlists paging stops at the first already known ID; removals are not
+    visible in that case and ``removed`` is None.
+    """
+    from pytubefix import extract
+    known_ids = snapshot["video_ids"] if snapshot else []
+    length = reported_length(playlist)
+    known = set(known_ids)
+    current_ids = []
+    seen = set()
+    for url in playlist.url_generator():
+        video_id = extract.video_id(url)
+        if newest_first and video_id in known:
+            video_ids = current_ids + [known_id for known_id in known_ids if known_id not in seen]
+            return {"video_ids": video_ids, "added": current_ids, "removed": None, "reported_length": length, "complete": False}
+        if video_id not in seen:
+            seen.add(video_id)
+            current_ids.append(video_id)
+    added = [video_id for video_id in current_ids if video_id not in known]
+    removed = [video_id for video_id in known_ids if video_id not in seen]
+    return {"video_ids": current_ids, "added": added, "removed": removed, "reported_length": length, "complete": True}
@@ -0,0 +1,284 @@
+import os, json, time, hashlib, threading, http.client
+from urllib.parse import urlsplit, urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+USER_AGENT = "Mozilla/5.0"
+BLOCK_SIZE = 64 * 1024
+
+
+class RangedDownloadError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, reused per (scheme, host, port)."""
+
+    def __init__(self, max_idle_per_host=8, timeout=30):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def _key(self, url):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        return parts.scheme, parts.hostname, port
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def request(self, method, url, headers=None, max_redirects=5):
+        """Returns (response, release); call release(reusable) when done reading."""
+        for _ in range(max_redirects + 1):
+            key = self._key(url)
+            parts = urlsplit(url)
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+            all_headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+            all_headers.update(headers or {})
+            with self.lock:
+                idle = self.idle.get(key)
+                conn = idle.pop() if idle else None
+            try:
+                if conn is not None:
+                    try:
+                        conn.request(method, target, headers=all_headers)
+                        response = conn.getresponse()
+                    except (http.client.HTTPException, OSError):
+                        # the server closed an idle keep-alive connection
+                        conn.close()
+                        conn = None
+                if conn is None:
+                    conn = self._connect(key)
+                    conn.request(method, target, headers=all_headers)
+                    response = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                response.read()
+                self._release(key, conn, not response.will_close)
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            return response, lambda reusable=True, key=key, conn=conn, response=response: self._release(key, conn, reusable and not response.will_close)
+        raise RangedDownloadError(f"Too many redirects for {url}")
+
+    def _release(self, key, conn, reusable):
+        if not reusable:
+            conn.close()
+            return
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def parse_content_range(value):
+    # "bytes 0-0/12345" -> 12345
+    try:
+        total = value.rsplit("/", 1)[1]
+        return None if total == "*" else int(total)
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class RangedDownloader:
+    """Resumable HTTP downloader that splits large files across connections.
+
+    Data is written to a preallocated ``<path>.part`` and the progress of
+    each range is checkpointed to ``<path>.part.json``, so an interrupted
+    download, whether it dropped mid-request or the process died, continues
+    where each range stopped. Each range is fetched in requests of at most
+    ``request_size`` bytes, which is also the size googlevideo serves
+    without throttling. An optional shared ``limiter`` (see rate_limit.py)
+    caps the request rate and aggregate bandwidth.
+    """
+
+    def __init__(self, connections=4, request_size=9 * 1024 * 1024, min_split_size=16 * 1024 * 1024,
+                 max_retries=3, retry_delay=1, pool=None, limiter=None):
+        self.connections = max(1, connections)
+        self.request_size = request_size
+        self.min_split_size = min_split_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.pool = pool or ConnectionPool(max_idle_per_host=max(8, self.connections))
+        self.limiter = limiter
+
+    def _request(self, url, headers):
+        if self.limiter:
+            self.limiter.acquire_request()
+        return self.pool.request("GET", url, headers)
+
+    def content_length(self, url):
+        response, release = self._request(url, {"Range": "bytes=0-0"})
+        response.read()
+        release()
+        if response.status == 206:
+            return parse_content_range(response.getheader("Content-Range"))
+        if response.status == 200:
+            length = response.getheader("Content-Length")
+            return int(length) if length else None
+        raise RangedDownloadError(f"HTTP {response.status} for {url}", response.status)
+
+    def _fetch(self, url, start, end, write, progress=None):
+        """Fetches bytes start..end (inclusive), retrying dropped connections from where they stopped."""
+        position = start
+        attempt = 0
+        while position <= end:
+            request_end = min(end, position + self.request_size - 1)
+            try:
+                response, release = self._request(url, {"Range": f"bytes={position}-{request_end}"})
+                if response.status == 200 and position == 0:
+                    request_end = end
+                elif response.status != 206:
+                    response.read()
+                    release(False)
+                    raise RangedDownloadError(f"HTTP {response.status} for range {position}-{request_end}", response.status)
+                reusable = False
+                try:
+                    while position <= request_end:
+                        block = response.read(min(BLOCK_SIZE, request_end - position + 1))
+                        if not block:
+                            break
+                        if self.limiter:
+                            self.limiter.acquire_bytes(len(block))
+                        write(position, block)
+                        position += len(block)
+                        if progress:
+                            progress(len(block))
+                    reusable = position > request_end and response.status == 206
+                finally:
+                    release(reusable)
+                if position <= request_end:
+                    raise http.client.IncompleteRead(b"", request_end - position + 1)
+                attempt = 0
+            except (http.client.HTTPException, OSError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise RangedDownloadError(f"Connection failed at byte {position}: {e}")
+                time.sleep(self.retry_delay)
+        return position
+
+    def iter_chunks(self, url, size=None):
+        """Yields the body in order over a pooled connection, resuming on drops."""
+        if size is None:
+            size = self.content_length(url)
+        if size is None:
+            raise RangedDownloadError(f"Server did not report a size for {url}")
+        position = 0
+        while position < size:
+            end = min(size, position + self.request_size) - 1
+            blocks = []
+            position = self._fetch(url, position, end, lambda offset, block: blocks.append(block))
+            yield b"".join(blocks)
+
+    def _load_ranges(self, state_path, size):
+        try:
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            if state.get("size") == size:
+                return state["ranges"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _plan_ranges(self, size):
+        connections = self.connections if size >= self.min_split_size else 1
+        step = max(1, -(-size // connections))
+        return [[start, min(size, start + step) - 1, start] for start in range(0, size, step)]
+
+    def download(self, url, path, size=None, progress=None, checksum=None):
+        """Downloads url to path and returns path.
+
+        progress(bytes_done, total) is called as data arrives. checksum is an
+        optional ``(algorithm, hexdigest)`` pair verified before the file is
+        moved into place; the size is always checked.
+        """
+        if size is None:
+            size = self.content_length(url)
+        if size is None:
+            raise RangedDownloadError(f"Server did not report a size for {url}")
+        part_path = path + ".part"
+        state_path = part_path + ".json"
+        lock = threading.Lock()
+
+        def save_state():
+            with open(state_path + ".tmp", "w") as f:
+                json.dump({"size": size, "ranges": ranges}, f)
+            os.replace(state_path + ".tmp", state_path)
+
+        ranges = self._load_ranges(state_path, size) if os.path.exists(part_path) else None
+        if ranges is None:
+            ranges = self._plan_ranges(size)
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+            save_state()
+        done = [sum(position - start for start, _, position in ranges)]
+
+        def report(count):
+            with lock:
+                done[0] += count
+                current = done[0]
+            if progress:
+                progress(current, size)
+
+        def fetch_range(item):
+            start, end, position = item
+            if position > end:
+                return
+            saved = [position]
+            with open(part_path, "r+b") as f:
+                def write(offset, block):
+                    f.seek(offset)
+                    f.write(block)
+                    item[2] = offset + len(block)
+                    if item[2] - saved[0] >= self.request_size:
+                        f.flush()
+                        with lock:
+                            save_state()
+                        saved[0] = item[2]
+                try:
+                    self._fetch(url, position, end, write, report)
+                finally:
+                    f.flush()
+                    with lock:
+                        save_state()
+
+        if len(ranges) == 1:
+            fetch_range(ranges[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                list(executor.map(fetch_range, ranges))
+        actual_size = os.path.getsize(part_path)
+        if actual_size != size or any(position <= end for _, end, position in ranges):
+            raise RangedDownloadError(f"Size mismatch for {path}: expected {size} bytes, got {actual_size}")
+        if checksum:
+            algorithm, expected = checksum
+            digest = hashlib.new(algorithm)
+            with open(part_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            if digest.hexdigest() != expected.lower():
+                os.remove(part_path)
+                if os.path.exists(state_path):
+                    os.remove(state_path)
+                raise RangedDownloadError(f"Checksum mismatch for {path}")
+        os.replace(part_path, path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return path
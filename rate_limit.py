@@ -0,0 +1,105 @@
+import time, threading
+from collections import deque
+
+UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_rate(value):
+    """Accepts a number or a string such as "2M" or "512k/s"; None, 0 and "" mean unlimited."""
+    if value in (None, "", 0):
+        return None
+    if isinstance(value, str):
+        text = value.strip().lower().removesuffix("/s").removesuffix("b")
+        multiplier = UNITS.get(text[-1:], 1)
+        value = float(text[:-1] if text[-1:] in UNITS else text) * multiplier
+    value = float(value)
+    return value if value > 0 else None
+
+
+class TokenBucket:
+    """Thread-safe token bucket. Callers may overdraw it and then sleep off the debt,
+    so requests larger than the burst still go through and waiters are served in order."""
+
+    def __init__(self, rate=None, burst=None):
+        self.lock = threading.Lock()
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst or (max(rate, 1) if rate else 0)
+            self.tokens = self.burst
+            self.updated = time.monotonic()
+
+    def acquire(self, amount=1):
+        """Takes amount tokens, sleeping until they are paid for. Returns the seconds waited."""
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimiter:
+    """Process-wide caps on bytes/sec and requests/sec, with live throughput stats.
+
+    One instance is shared by every download and metadata fetch.
+    ``configure`` can be called at any time; it takes effect for the next
+    acquire.
+    """
+
+    def __init__(self, bytes_per_second=None, requests_per_second=None, window=5.0):
+        self.bytes = TokenBucket()
+        self.requests = TokenBucket()
+        self.window = window
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.samples = deque()
+        self.totals = {"bytes": 0, "requests": 0, "throttled_seconds": 0.0}
+        self.configure(bytes_per_second, requests_per_second)
+
+    def configure(self, bytes_per_second=None, requests_per_second=None):
+        self.bytes.configure(parse_rate(bytes_per_second))
+        self.requests.configure(parse_rate(requests_per_second))
+
+    def _record(self, byte_count, request_count, waited):
+        now = time.monotonic()
+        with self.lock:
+            self.totals["bytes"] += byte_count
+            self.totals["requests"] += request_count
+            self.totals["throttled_seconds"] += waited
+            self.samples.append((now, byte_count, request_count))
+            while self.samples and self.samples[0][0] < now - self.window:
+                self.samples.popleft()
+
+    def acquire_bytes(self, count):
+        self._record(count, 0, self.bytes.acquire(count))
+
+    def acquire_request(self):
+        self._record(0, 1, self.requests.acquire(1))
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.samples and self.samples[0][0] < now - self.window:
+                self.samples.popleft()
+            recent_bytes = sum(sample[1] for sample in self.samples)
+            recent_requests = sum(sample[2] for sample in self.samples)
+            stats = dict(self.totals)
+        elapsed = now - self.started_at
+        span = min(self.window, elapsed) or 1.0
+        stats.update({
+            "bytes_per_second": round(recent_bytes / span),
+            "bytes_limit": self.bytes.rate,
+            "requests_per_second": round(recent_requests / span, 2),
+            "requests_limit": self.requests.rate,
+            "average_bytes_per_second": round(stats["bytes"] / elapsed) if elapsed else 0,
+            "throttled_seconds": round(stats["throttled_seconds"], 3),
+        })
+        return stats
@@ -0,0 +1,111 @@
+import sys, time, random, socket
+
+TRANSIENT = "transient"
+THROTTLED = "throttled"
+PERMANENT = "permanent"
+
+THROTTLED_STATUS = {429}
+PERMANENT_STATUS = {400, 401, 404, 451}
+
+
+def error_chain(error):
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def pytubefix_error_kind(error):
+    # pytubefix is imported lazily; if it is not loaded yet the error cannot have come from it
+    exceptions = sys.modules.get("pytubefix.exceptions")
+    if exceptions is None:
+        return None
+    if isinstance(error, (exceptions.BotDetection, exceptions.PoTokenRequired)):
+        return THROTTLED
+    if isinstance(error, (exceptions.VideoUnavailable, exceptions.RegexMatchError)):
+        return PERMANENT
+    return None
+
+
+def loaded_error_types(*names):
+    # looks exception classes up only in modules that are already imported, as in pytubefix_error_kind
+    types = []
+    for name in names:
+        module_name, _, class_name = name.rpartition(".")
+        module = sys.modules.get(module_name)
+        if module is not None:
+            types.append(getattr(module, class_name))
+    return tuple(types)
+
+
+def http_status(error):
+    if isinstance(error, loaded_error_types("urllib.error.HTTPError")):
+        return error.code
+    return getattr(error, "status", None)
+
+
+def classify_error(error):
+    """Sorts an exception, or anything in its cause chain, into transient, throttled or permanent."""
+    for current in error_chain(error):
+        kind = pytubefix_error_kind(current)
+        if kind is not None:
+            return kind
+        status = http_status(current)
+        if status in THROTTLED_STATUS:
+            return THROTTLED
+        if status in PERMANENT_STATUS:
+            return PERMANENT
+        if isinstance(current, loaded_error_types("transcode.FFmpegNotFound")):
+            return PERMANENT
+        if isinstance(current, (socket.timeout, ConnectionError) + loaded_error_types("http.client.HTTPException", "urllib.error.URLError")):
+            return TRANSIENT
+    return TRANSIENT
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter, driven by the error classification.
+
+    Permanent failures (private, removed or region-blocked videos, bad
+    URLs) are never retried. Throttled failures back off from
+    ``throttle_delay`` instead of ``base_delay``.
+    """
+
+    def __init__(self, max_attempts=10, base_delay=1.0, max_delay=60.0, throttle_delay=30.0, jitter=0.5):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_delay = throttle_delay
+        self.jitter = min(max(jitter, 0.0), 1.0)
+
+    def classify(self, error):
+        return classify_error(error)
+
+    def should_retry(self, kind, attempt):
+        return kind != PERMANENT and attempt + 1 < self.max_attempts
+
+    def delay(self, kind, attempt):
+        base = self.throttle_delay if kind == THROTTLED else self.base_delay
+        delay = min(self.max_delay, base * (2 ** attempt))
+        return random.uniform(delay * (1 - self.jitter), delay)
+
+    def call(self, func, *args, on_retry=None, wait=time.sleep, **kwargs):
+        """Runs func until it succeeds, the error is permanent, or attempts run out.
+
+        The backoff between attempts is spent in wait(delay), which a caller
+        can replace with something that returns or raises early, such as a
+        cancellation event's wait.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                kind = self.classify(e)
+                if not self.should_retry(kind, attempt):
+                    raise
+                delay = self.delay(kind, attempt)
+                attempt += 1
+                if on_retry:
+                    on_retry(attempt, self.max_attempts, e, kind, delay)
+                wait(delay)
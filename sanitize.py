@@ -0,0 +1,37 @@
+import os, unicodedata
+from functools import lru_cache
+
+# characters Windows does not allow in file names, plus the single quote
+FORBIDDEN = str.maketrans("", "", '\\/:*?"\'<>|')
+
+
+def truncate_utf8(text, max_bytes):
+    """Longest prefix of text that fits in max_bytes of UTF-8, cut on a character boundary."""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max(0, max_bytes)].decode("utf-8", "ignore")
+
+
+@lru_cache(maxsize=4096)
+def sanitize_filename(name, max_length, suffix=""):
+    """Cleans a video or playlist title into a file name of at most max_length bytes of UTF-8.
+
+    Each step is a single pass over the title, so very long titles cost
+    linear time. Results are cached by (name, max_length, suffix), since
+    retries and re-runs clean the same titles again.
+    """
+    name = unicodedata.normalize("NFKC", name)
+    base_name, extension = os.path.splitext(name)
+    cleaned_base = base_name.translate(FORBIDDEN)
+    if not cleaned_base.isprintable():
+        cleaned_base = "".join(filter(str.isprintable, cleaned_base))
+    available_length = max_length - len(extension.encode("utf-8"))
+    # measured in bytes: file systems limit name length in bytes, and CJK or emoji take 3-4 each
+    if len(cleaned_base.encode("utf-8")) > available_length:
+        budget = available_length - len(suffix.encode("utf-8"))
+        if budget > 0:
+            cleaned_base = truncate_utf8(cleaned_base, budget) + suffix
+        else:
+            cleaned_base = truncate_utf8(cleaned_base, available_length)
+    return f"{cleaned_base}{extension}"
@@ -0,0 +1,127 @@
+import os, shutil
+
+HARDLINK = "hardlink"
+REFLINK = "reflink"
+M3U = "m3u"
+MODES = (HARDLINK, REFLINK, M3U)
+
+# ioctl request that clones a file's extents on Linux (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+
+class ContentPlan:
+    """Which folder fetches each video, and where else it has to be placed.
+
+    ``fetch`` maps each folder to the video IDs it downloads, ``placements``
+    lists (video_id, folder) pairs that are filled from another copy
+    instead, and ``locations`` maps a video ID to the file the placements
+    are made from. ``entries`` keeps every folder's full list of video IDs
+    in playlist order, for M3U files.
+    """
+
+    def __init__(self):
+        self.sources = []
+        self.entries = {}
+        self.fetch = {}
+        self.present = {}
+        self.placements = []
+        self.locations = {}
+        self.reused = set()
+
+    @property
+    def total_entries(self):
+        return sum(len(video_ids) for video_ids in self.entries.values())
+
+    @property
+    def unique_videos(self):
+        return len({video_id for video_ids in self.entries.values() for video_id in video_ids})
+
+    def counts(self):
+        return {
+            "sources": len(self.sources),
+            "entries": self.total_entries,
+            "unique": self.unique_videos,
+            "fetch": sum(len(video_ids) for video_ids in self.fetch.values()),
+            "present": sum(len(video_ids) for video_ids in self.present.values()),
+            "place": len(self.placements),
+            "reused": len(self.reused),
+        }
+
+
+def plan_shared_content(sources, archive, kind):
+    """Builds a ContentPlan for sources, a list of (name, folder, video_ids).
+
+    A video that is already in a folder (per the download archive) is left
+    alone. Otherwise the first folder that lists it fetches it, unless a
+    copy from an earlier run is in the archive, and every other folder
+    gets it placed from that one copy.
+    """
+    plan = ContentPlan()
+    claimed = set()
+    for name, folder, video_ids in sources:
+        plan.sources.append((name, folder))
+        video_ids = list(dict.fromkeys(video_ids))
+        plan.entries[folder] = video_ids
+        fetch = plan.fetch.setdefault(folder, [])
+        present = plan.present.setdefault(folder, [])
+        for video_id in video_ids:
+            entry = archive.lookup(video_id, kind, folder) if archive is not None else None
+            if entry is not None:
+                present.append(video_id)
+                plan.locations.setdefault(video_id, entry["path"])
+                claimed.add(video_id)
+                continue
+            if video_id in claimed:
+                plan.placements.append((video_id, folder))
+                continue
+            earlier = None
+            if archive is not None:
+                for candidate in archive.find(video_id, kind):
+                    earlier = archive.lookup(video_id, kind, candidate["directory"])
+                    if earlier is not None:
+                        break
+            claimed.add(video_id)
+            if earlier is not None:
+                plan.locations[video_id] = earlier["path"]
+                plan.reused.add(video_id)
+                plan.placements.append((video_id, folder))
+            else:
+                fetch.append(video_id)
+    return plan
+
+
+def reflink(source, target):
+    import fcntl
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+
+
+def link_file(source, target, mode):
+    """Creates target as a hardlink or reflink of source, copying when the file system cannot. Returns the method used."""
+    try:
+        if mode == REFLINK:
+            reflink(source, target)
+        else:
+            os.link(source, target)
+        return mode
+    except (OSError, ImportError):
+        # different device, FAT/exFAT, or no reflink support
+        if os.path.exists(target):
+            os.remove(target)
+    shutil.copyfile(source, target)
+    return "copy"
+
+
+def write_m3u(path, entries):
+    """Writes an extended M3U playlist of (title, file path) entries, with paths relative to the playlist."""
+    directory = os.path.dirname(os.path.abspath(path))
+    lines = ["#EXTM3U"]
+    for title, file_path in entries:
+        lines.append(f"#EXTINF:-1,{title}")
+        try:
+            lines.append(os.path.relpath(file_path, directory))
+        except ValueError:
+            # on another drive on Windows
+            lines.append(os.path.abspath(file_path))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
@@ -0,0 +1,85 @@
+VIDEO_CODECS = ("avc1", "vp9", "av01")
+AUDIO_CODECS = ("mp4a", "opus")
+
+
+def codec_name(codec):
+    # "avc1.640028" -> "avc1", "av01.0.08M.08" -> "av01"
+    return (codec or "").split(".")[0]
+
+
+def bitrate_kbps(value):
+    """kbps from an ffmpeg-style bitrate such as "128k" or 128000; None when unset."""
+    if not value:
+        return None
+    text = str(value).strip().lower().removesuffix("bps")
+    if text.endswith("k"):
+        return float(text[:-1])
+    return float(text) / 1000
+
+
+def preferred(streams, codecs, field):
+    """The streams whose codec comes earliest in codecs; codecs that are not listed come after every listed one."""
+    def rank(stream):
+        name = codec_name(stream[field])
+        return codecs.index(name) if name in codecs else len(codecs)
+    best = min(map(rank, streams), default=None)
+    return [stream for stream in streams if rank(stream) == best]
+
+
+def within_size(streams, max_size, extra=0):
+    """The streams that fit in max_size bytes along with extra; streams of unknown size count as fitting.
+    If none fits, the smallest."""
+    if not max_size:
+        return streams
+    fitting = [stream for stream in streams if stream["filesize"] is None or stream["filesize"] + extra <= max_size]
+    return fitting or sorted(streams, key=lambda stream: stream["filesize"])[:1]
+
+
+def select_audio_stream(streams, codecs=AUDIO_CODECS, target_bitrate=None, max_size=None):
+    """Audio-only stream to download.
+
+    Only streams of the earliest codec in codecs that the video offers are
+    considered. Without target_bitrate (kbps) the highest bitrate wins, like
+    StreamQuery.get_audio_only(). With it, the lowest bitrate at or above
+    the target wins, since an encoder at that bitrate throws the rest away;
+    the highest if none reaches it.
+    """
+    candidates = [stream for stream in streams if stream["includes_audio_track"] and not stream["includes_video_track"]]
+    candidates = preferred(within_size(candidates, max_size), list(codecs), "audio_codec")
+    if target_bitrate:
+        enough = [stream for stream in candidates if (stream["abr"] or 0) >= target_bitrate]
+        if enough:
+            return min(enough, key=lambda stream: stream["abr"])
+    return max(candidates, key=lambda stream: stream["abr"] or 0, default=None)
+
+
+def select_video_streams(streams, max_resolution=None, video_codecs=VIDEO_CODECS, audio_codecs=AUDIO_CODECS,
+                         target_bitrate=None, max_size=None):
+    """Adaptive video-only and audio-only streams to fetch separately and mux, as (video, audio).
+
+    The audio is chosen as in select_audio_stream. The video is the highest
+    resolution up to max_resolution (the lowest on offer if every stream is
+    above it), of the earliest codec in video_codecs that is available at
+    that size, then the highest frame rate and the fewest bytes. With
+    max_size, lower resolutions are used until video and audio fit.
+    Returns (None, None) when the video has no adaptive streams.
+    """
+    audio = select_audio_stream(streams, audio_codecs, target_bitrate)
+    videos = [stream for stream in streams if stream["includes_video_track"] and not stream["includes_audio_track"] and stream["resolution"]]
+    if audio is None or not videos:
+        return None, None
+    capped = [stream for stream in videos if max_resolution is None or stream["resolution"] <= max_resolution]
+    if not capped:
+        lowest = min(stream["resolution"] for stream in videos)
+        capped = [stream for stream in videos if stream["resolution"] == lowest]
+    capped = within_size(capped, max_size, audio["filesize"] or 0)
+    best = max(stream["resolution"] for stream in capped)
+    candidates = preferred([stream for stream in capped if stream["resolution"] == best], list(video_codecs), "video_codec")
+    video = max(candidates, key=lambda stream: (stream["fps"] or 0, -(stream["filesize"] or stream["bitrate"] or 0)))
+    return video, audio
+
+
+def select_progressive_stream(streams, subtype="mp4"):
+    """Highest-resolution progressive stream, like StreamQuery.get_highest_resolution()."""
+    candidates = [stream for stream in streams if stream["is_progressive"] and stream["subtype"] == subtype]
+    return max(candidates, key=lambda stream: stream["resolution"] or 0, default=None)
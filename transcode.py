@@ -0,0 +1,149 @@
+import os, shutil, subprocess
+
+# codec -> (file extension, ffmpeg muxer) used when the codec is kept as-is
+AUDIO_CONTAINERS = {
+    "mp4a": ("m4a", "ipod"),
+    "opus": ("opus", "opus"),
+    "vorbis": ("ogg", "ogg"),
+    "mp3": ("mp3", "mp3"),
+}
+# target format -> (codec, ffmpeg encoder)
+AUDIO_TARGETS = {
+    "mp3": ("mp3", "libmp3lame"),
+    "m4a": ("mp4a", "aac"),
+    "opus": ("opus", "libopus"),
+    "ogg": ("vorbis", "libvorbis"),
+}
+AUDIO_POLICIES = ("original", "remux", "auto", "transcode")
+# containers that separate video and audio streams are copied into: (file extension, ffmpeg muxer, video codecs, audio codecs)
+VIDEO_CONTAINERS = (
+    ("mp4", "mp4", {"avc1", "av01", "vp9", "hev1", "hvc1"}, {"mp4a"}),
+    ("webm", "webm", {"vp8", "vp9", "av01"}, {"opus", "vorbis"}),
+)
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class FFmpegNotFound(TranscodeError):
+    """No ffmpeg on PATH or from imageio-ffmpeg; retrying cannot help, so it is classified as permanent."""
+
+
+def ffmpeg_executable():
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+    except ImportError:
+        raise FFmpegNotFound("ffmpeg executable not found; install ffmpeg or the imageio-ffmpeg package")
+    try:
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except RuntimeError as e:
+        raise FFmpegNotFound(f"ffmpeg executable not found: {e}")
+
+
+def remove_partial(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def plan_audio_output(source_codec, source_extension, policy="auto", target="mp3", bitrate=None):
+    """Decides how a downloaded audio stream becomes the output file.
+
+    Returns ``(extension, codec_args)``. ``codec_args`` is None when the
+    downloaded bytes are kept untouched, otherwise the ffmpeg output
+    arguments for either a stream copy (remux) or a re-encode.
+
+    * ``original``: keep the source container.
+    * ``remux``: copy the source codec into its standalone container.
+    * ``auto``: remux when the source codec already matches ``target``,
+      transcode otherwise.
+    * ``transcode``: always encode to ``target``.
+    """
+    if policy not in AUDIO_POLICIES:
+        raise TranscodeError(f"Unknown audio policy: {policy}")
+    if target not in AUDIO_TARGETS:
+        raise TranscodeError(f"Unknown audio format: {target}")
+    codec = (source_codec or "").split(".")[0]
+    if policy == "original":
+        return source_extension, None
+    target_codec, encoder = AUDIO_TARGETS[target]
+    if codec in AUDIO_CONTAINERS and (policy == "remux" or (policy == "auto" and codec == target_codec)):
+        extension, muxer = AUDIO_CONTAINERS[codec]
+        return extension, ["-vn", "-codec:a", "copy", "-f", muxer]
+    codec_args = ["-vn", "-codec:a", encoder]
+    if target == "mp3":
+        codec_args += ["-ar", "44100"]
+    if bitrate:
+        codec_args += ["-b:a", str(bitrate)]
+    return target, codec_args + ["-f", AUDIO_CONTAINERS[target_codec][1]]
+
+
+def plan_video_output(video_codec, audio_codec):
+    """Container for a video muxed from separate video and audio streams without re-encoding.
+
+    Returns ``(extension, codec_args)`` for transcode_file() with the video
+    as the first input and the audio as the second: MP4 where both codecs
+    fit in it, WebM for VP9/AV1 with Opus, and Matroska otherwise.
+    """
+    video, audio = (video_codec or "").split(".")[0], (audio_codec or "").split(".")[0]
+    extension, muxer = "mkv", "matroska"
+    for container, container_muxer, video_codecs, audio_codecs in VIDEO_CONTAINERS:
+        if video in video_codecs and audio in audio_codecs:
+            extension, muxer = container, container_muxer
+            break
+    return extension, ["-map", "0:v:0", "-map", "1:a:0", "-codec", "copy", "-f", muxer]
+
+
+def transcode_file(input_path, output_path, codec_args):
+    # input_path may also be a list of inputs, such as the video and audio streams to mux
+    inputs = [input_path] if isinstance(input_path, str) else list(input_path)
+    part_path = output_path + ".part"
+    command = ([ffmpeg_executable(), "-hide_banner", "-loglevel", "error", "-y"] + [arg for path in inputs for arg in ("-i", path)]
+               + list(codec_args) + [part_path])
+    try:
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise TranscodeError(result.stderr.decode("utf-8", "replace").strip() or f"ffmpeg exited with code {result.returncode}")
+        os.replace(part_path, output_path)
+    except BaseException:
+        remove_partial(part_path)
+        raise
+
+
+def stream_to_file(chunks, output_path, codec_args):
+    """Pipes downloaded chunks straight into ffmpeg and writes only the output.
+
+    Each chunk is written to ffmpeg's stdin as it arrives, so memory is
+    bounded by one download chunk plus the OS pipe buffer. The encoder
+    writes to a ``.part`` file that is renamed into place on success and
+    removed on any failure.
+    """
+    part_path = output_path + ".part"
+    # -xerror: ffmpeg otherwise exits 0 when the piped input cannot be demuxed (e.g. moov atom at the end)
+    command = [ffmpeg_executable(), "-hide_banner", "-loglevel", "error", "-xerror", "-y", "-i", "pipe:0"] + list(codec_args) + [part_path]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise TranscodeError(stderr.decode("utf-8", "replace").strip() or f"ffmpeg exited with code {process.returncode}")
+        os.replace(part_path, output_path)
+    except BaseException:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        remove_partial(part_path)
+        raise
+    finally:
+        process.stderr.close()